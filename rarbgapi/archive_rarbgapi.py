@@ -0,0 +1,199 @@
+"""Archive of the raw listing pages fetched: compressed, deduplicated and bounded, for offline re-parsing"""
+import gzip
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    query TEXT,
+    page_num INTEGER,
+    status INTEGER,
+    fetched REAL NOT NULL,
+    hash TEXT NOT NULL REFERENCES blobs(hash)
+);
+CREATE INDEX IF NOT EXISTS pages_query ON pages(query, page_num);
+CREATE INDEX IF NOT EXISTS pages_fetched ON pages(fetched);
+CREATE INDEX IF NOT EXISTS pages_hash ON pages(hash);
+"""
+
+_STOP = object()
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def compress(data, codec):
+    if codec == "zstd":
+        return _zstd().ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def decompress(data, codec):
+    if codec == "zstd":
+        zstandard = _zstd()
+        if zstandard is None:
+            raise ImportError("this archive page is zstd compressed, pip install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class PageArchive:
+    """SQLite file of fetched pages, compressed with zstd (if installed) or gzip.
+
+    Identical pages are stored once (keyed by their SHA-256). `add` only queues the
+    page: compression and writes happen on a background thread, so fetching never
+    waits on the disk. Pages older than `max_age` seconds are dropped, then the oldest
+    ones until the compressed pages fit in `max_bytes`. `pages` reads them back for
+    re-parsing without the network.
+    """
+
+    def __init__(self, path, max_bytes=200 * 10**6, max_age=30 * 86400, codec=None, prune_every=50):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.codec = codec or ("zstd" if _zstd() is not None else "gzip")
+        self.prune_every = prune_every
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+        self._queue = queue.Queue()
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, url, content, query=None, page_num=None, status=200):
+        """Queue a fetched page (bytes) for archiving, returns immediately"""
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="rarbgapi-archive", daemon=True)
+            self._writer.start()
+        self._queue.put((url, content, query, page_num, status, time.time()))
+
+    def flush(self):
+        """Wait for the queued pages to be written"""
+        self._queue.join()
+
+    def close(self):
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+        self._connection.close()
+
+    def _write_loop(self):
+        written = 0
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    self.prune()
+                    return
+                self._write(*item)
+                written += 1
+                if written % self.prune_every == 0:
+                    self.prune()
+            except (OSError, sqlite3.Error) as e:
+                logging.warning("Couldn't archive page: %s", e)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, url, content, query, page_num, status, fetched):
+        digest = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            known = self._connection.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        data = None if known else compress(content, self.codec)
+        with self._lock, self._connection:
+            if data is not None:
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO blobs (hash, codec, size, stored, data) VALUES (?, ?, ?, ?, ?)",
+                    (digest, self.codec, len(content), len(data), data))
+            self._connection.execute(
+                "INSERT INTO pages (url, query, page_num, status, fetched, hash) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, query, page_num, status, fetched, digest))
+
+    def prune(self):
+        """Apply the retention policy: drop pages past `max_age`, then the oldest past `max_bytes`"""
+        with self._lock, self._connection:
+            connection = self._connection
+            if self.max_age is not None:
+                connection.execute("DELETE FROM pages WHERE fetched < ?", (time.time() - self.max_age,))
+            self._drop_orphans()
+            total = connection.execute("SELECT COALESCE(SUM(stored), 0) FROM blobs").fetchone()[0]
+            while self.max_bytes is not None and total > self.max_bytes:
+                # a tenth of the pages at a time, oldest first
+                count = connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+                if not count:
+                    break
+                connection.execute("DELETE FROM pages WHERE id IN (SELECT id FROM pages ORDER BY fetched LIMIT ?)",
+                                   (max(1, count // 10),))
+                self._drop_orphans()
+                total = connection.execute("SELECT COALESCE(SUM(stored), 0) FROM blobs").fetchone()[0]
+
+    def _drop_orphans(self):
+        self._connection.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM pages)")
+
+    def vacuum(self):
+        """Give the space of dropped pages back to the filesystem"""
+        with self._lock:
+            self._connection.execute("VACUUM")
+
+    def pages(self, query=None, latest=False):
+        """Archived pages as dicts (url, query, page_num, status, fetched, content), oldest first.
+
+        With `query` only the pages of that query (cache_rarbgapi.query_key without a
+        page), with `latest` only the last fetched copy of every page number.
+        """
+        sql = "SELECT p.id, p.url, p.query, p.page_num, p.status, p.fetched, p.hash FROM pages p"
+        params = []
+        if query is not None:
+            sql += " WHERE p.query = ?"
+            params.append(query)
+        if latest:
+            sql += (" AND" if params else " WHERE") + (
+                " p.id = (SELECT id FROM pages q WHERE q.query IS p.query AND q.page_num IS p.page_num"
+                " ORDER BY q.fetched DESC LIMIT 1)")
+        sql += " ORDER BY p.page_num, p.fetched" if latest else " ORDER BY p.fetched"
+        with self._lock:
+            rows = [dict(row) for row in self._connection.execute(sql, params)]
+        for row in rows:
+            with self._lock:
+                blob = self._connection.execute("SELECT codec, data FROM blobs WHERE hash = ?",
+                                                (row.pop("hash"),)).fetchone()
+            if blob is None:  # pruned meanwhile
+                continue
+            row["content"] = decompress(blob["data"], blob["codec"])
+            yield row
+
+    def stats(self):
+        """{"pages", "blobs", "bytes" (uncompressed), "stored" (compressed)}"""
+        with self._lock:
+            pages = self._connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            blobs, size, stored = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored), 0) FROM blobs").fetchone()
+        return {"pages": pages, "blobs": blobs, "bytes": size, "stored": stored}
@@ -0,0 +1,1278 @@
+"""
+Benchmarks for rarbgapi against a local stand-in HTTP server.
+
+The stand-in serves generated listing pages shaped like the real torrents.php
+output, so no network access (and no CAPTCHA) is involved. It can replay pages
+recorded with `record` instead (listing, detail and threat_defence.php pages).
+
+    python bench_rarbgapi.py suite --output results.json [--fixtures DIR] [--compare baseline.json]
+    python bench_rarbgapi.py record DIR --search "some movie" [--domain rarbgunblocked.org]
+    python bench_rarbgapi.py record DIR --generate
+    python bench_rarbgapi.py pages --pages 20 --latency 0.1 --concurrency 1 4 8
+    python bench_rarbgapi.py session --requests 200
+    python bench_rarbgapi.py details --torrents 50 --latency 0.1 --workers 1 4 8
+    python bench_rarbgapi.py parse [saved/*.html]
+    python bench_rarbgapi.py mirrors --pages 20 --latency 0.02
+    python bench_rarbgapi.py schedule --max_rate 30
+    python bench_rarbgapi.py filter --min_seeders 300
+    python bench_rarbgapi.py download --torrents 25 --workers 1 8
+    python bench_rarbgapi.py captcha --challenges 5
+    python bench_rarbgapi.py startup --budget 50
+
+`suite` measures end-to-end search latency, listing pages/s, parse time per page,
+magnet resolution, peak memory and request counts, and writes them as JSON along
+with the commit they were measured on. With --compare it exits non-zero when a
+metric regressed past --tolerance against an earlier results file.
+
+`startup` is a check rather than a benchmark: it exits non-zero when importing
+rarbgapi goes over the budget, loads a heavy dependency or touches the filesystem.
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import random
+import re
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from requests.utils import quote
+
+import requests
+from bs4 import BeautifulSoup
+
+import rarbgapi
+
+ROW_TEMPLATE = (
+    '<tr class="lista2">'
+    '<td align="left" class="lista"><a href="/torrents.php?category={cat}">'
+    '<img src="https://dyncdn.me/static/20/images/categories/cat_new{cat}.gif" border="0"></a></td>'
+    '<td align="left" class="lista"><a onmouseover="return overlib(\'&lt;img src=\\\'https://dyncdn.me/mimages/{id}/over/{hash}.jpg\\\' border=0&gt;\')" '
+    'onmouseout="return nd();" href="/torrent/{tid}" title="{title}">{title}</a></td>'
+    '<td align="center" width="150px" class="lista">{date}</td>'
+    '<td align="center" width="100px" class="lista">{size}</td>'
+    '<td align="center" width="50px" class="lista"><font color="#008000">{seeders}</font></td>'
+    '<td align="center" width="50px" class="lista">{leechers}</td>'
+    '<td align="center" class="lista">--</td>'
+    '<td align="center" class="lista">{uploader}</td>'
+    '</tr>'
+)
+
+
+def make_listing_page(page_num, rows=25, seed=0, seeders_from=None):
+    """Generate the HTML of a listing page with `rows` torrents.
+
+    With `seeders_from` the rows have seeders_from, seeders_from - 1, ... seeders
+    (a page of a listing ordered by seeders, descending).
+    """
+    rnd = random.Random(seed * 100003 + page_num)
+    body = []
+    for i in range(rows):
+        tid = f"{page_num:04d}{i:04d}{rnd.randrange(16**6):06x}"
+        body.append(ROW_TEMPLATE.format(
+            cat=rnd.choice(["48", "17", "41", "23", "27"]),
+            id=rnd.randrange(10**6),
+            hash=f"{rnd.getrandbits(160):040x}",
+            tid=tid,
+            title=f"Some.Torrent.{page_num}.{i}.1080p.WEB.x264-GRP",
+            date=time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1600000000 + rnd.randrange(10**8))),
+            size=f"{rnd.uniform(1, 999):.2f} {rnd.choice(['MB', 'GB'])}",
+            seeders=rnd.randrange(1000) if seeders_from is None else max(0, seeders_from - i),
+            leechers=rnd.randrange(500),
+            uploader=rnd.choice(["Scene", "uploader", "rarbg"]),
+        ))
+    return (
+        "<html><head><title>RARBG</title></head><body>"
+        '<table width="100%" class="lista2t"><tr><td class="header6">Cat.</td></tr>'
+        + "".join(body)
+        + "</table></body></html>"
+    )
+
+
+DETAIL_TEMPLATE = (
+    "<html><head><title>{title} Torrent download</title></head><body>"
+    '<table class="lista-rounded"><tr><td class="header2">Torrent:</td><td class="lista">'
+    '<a onmouseover="return overlib(\'Click here to download torrent\')" '
+    'href="/download.php?id={tid}&amp;f={title}-[rarbg.to].torrent">'
+    '<img src="https://dyncdn.me/static/20/img/dl.png"> {title}.torrent</a> '
+    '<a href="magnet:?xt=urn:btih:{hash}&amp;dn={title}&amp;tr=http%3A%2F%2Ftracker.trackerfix.com%3A80%2Fannounce">'
+    '<img src="https://dyncdn.me/static/20/img/magnet.gif"></a></td></tr>'
+    + "<tr><td class=\"lista\">{padding}</td></tr>"
+    + "</table></body></html>"
+)
+
+
+def make_detail_page(tid):
+    """Generate the HTML of a torrent detail page (magnet + .torrent links)"""
+    rnd = random.Random(tid)
+    return DETAIL_TEMPLATE.format(
+        tid=tid,
+        title=f"Some.Torrent.{tid}.1080p.WEB.x264-GRP",
+        hash=f"{rnd.getrandbits(160):040x}",
+        padding="<p>description</p>" * 500,
+    )
+
+
+def make_torrent_file(tid):
+    """A (bencoded) .torrent file for the torrent `tid`"""
+    name = f"Some.Torrent.{tid}.mkv"
+    return (f"d8:announce30:http://tracker.example/announce4:infod6:lengthi{len(tid) * 1000}e"
+            f"4:name{len(name)}:{name}12:piece lengthi262144eee").encode("ascii")
+
+
+CAPTCHA_ALPHABET = "ACDEFHJKLMNPRTUVWXY34679"  # no look-alikes (0/O, 1/I, 5/S, ...)
+DEFENCE_COOKIE = "bench_defence"
+
+def make_captcha_svg(text):
+    """A generated CAPTCHA image: `text` on a light noisy background"""
+    rnd = random.Random(text)
+    noise = "".join(
+        f'<line x1="{rnd.randrange(200)}" y1="{rnd.randrange(60)}" x2="{rnd.randrange(200)}" y2="{rnd.randrange(60)}" '
+        'stroke="#ccc" stroke-width="1"/>'
+        for _ in range(8)
+    )
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="200" height="60">'
+        f'<rect width="200" height="60" fill="#fff"/>{noise}'
+        f'<text x="20" y="42" font-family="monospace" font-size="32" fill="#000">{text}</text></svg>'
+    )
+
+
+def make_threat_defence_page(step, token):
+    """Generate the threat_defence.php pages: step 1 has the "Click here" link, step 2 the CAPTCHA form"""
+    if step == 1:
+        body = (
+            "<p>Please wait while we check your browser...</p>"
+            f'<a href="/threat_defence.php?defence=2&amp;token={token}">Click here</a>'
+        )
+    else:
+        body = (
+            f'<img src="/captcha.svg?token={token}" width="200" height="60">'
+            '<form method="get" action="/threat_defence.php">'
+            f'<input type="hidden" name="defence" value="2"><input type="hidden" name="token" value="{token}">'
+            '<input type="text" id="solve_string" name="solve_string"><input type="submit" value="Submit"></form>'
+        )
+    return f'<html><head><title>Threat defence</title></head><body><img src="/logo.svg">{body}</body></html>'
+
+
+FIXTURE_LISTING_RE = re.compile(r"listing_(\d+)\.html$")
+FIXTURE_DETAIL_RE = re.compile(r"detail_(.+)\.html$")
+FIXTURE_DEFENCE_RE = re.compile(r"threat_defence_([12])\.html$")
+TOKEN_RE = re.compile(rb'(token=|name="token" value=")[0-9A-Za-z]+')
+
+
+class Fixtures:
+    """Recorded pages for StandInServer to replay, read from a directory written by `record`.
+
+    listing_<page>.html are the listing pages, detail_<id>.html the detail page of
+    /torrent/<id> and threat_defence_<step>.html the threat defence pages (step 1 with the
+    "Click here" link, step 2 with the CAPTCHA form).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.listing, self.detail, self.defence = {}, {}, {}
+        for fname in sorted(os.listdir(directory)):
+            for pattern, pages, key in [(FIXTURE_LISTING_RE, self.listing, int),
+                                        (FIXTURE_DETAIL_RE, self.detail, str),
+                                        (FIXTURE_DEFENCE_RE, self.defence, int)]:
+                match = pattern.match(fname)
+                if match:
+                    with open(os.path.join(directory, fname), "rb") as page:
+                        pages[key(match[1])] = page.read()
+                    break
+        if not self.listing:
+            raise ValueError(f"no listing_<page>.html fixtures in {directory}")
+
+    @property
+    def pages(self):
+        """Recorded listing pages with torrents (the last one recorded is usually the empty one)"""
+        return [html for _, html in sorted(self.listing.items()) if rarbgapi.parse_listing(html)]
+
+    def listing_page(self, page_num):
+        return self.listing.get(page_num) or make_listing_page(page_num, 0).encode("utf-8")
+
+    def detail_page(self, tid):
+        """The recorded detail page of `tid`, or else any recorded one"""
+        if tid in self.detail:
+            return self.detail[tid]
+        if self.detail:
+            return next(iter(self.detail.values()))
+        return make_detail_page(tid).encode("utf-8")
+
+    def threat_defence_page(self, step, token):
+        if step not in self.defence:
+            return make_threat_defence_page(step, token).encode("utf-8")
+        # the recorded token is swapped for the current one so the CAPTCHA answer still matches
+        return TOKEN_RE.sub(lambda match: match[1] + token.encode("ascii"), self.defence[step])
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients closing connections (cancelled prefetches, pool shutdown) aren't errors here
+        pass
+
+
+class StandInServer:
+    """Local HTTP server replaying rarbg listing pages with configurable latency.
+
+    Pages 1..`pages` contain `rows` torrents each, later pages are empty.
+    Any /torrent/<id> path is answered with a detail page.
+    With `tls=True` it serves HTTPS using a throwaway self-signed certificate
+    (see `cafile` for the path to pass as `verify=`).
+    A fraction `error_rate` of the requests (set it to 1 to take the server down)
+    is answered with a 503 before any latency. Past `max_rate` requests in the last
+    second requests are answered with a 429 (counted in `throttled`).
+    With `captcha=True` pages are redirected to a threat_defence.php challenge (a
+    "Click here" page, then a generated CAPTCHA) until its cookie is sent;
+    `solves` counts the correct answers.
+    With `fixtures` (Fixtures) the recorded pages are served instead of generated ones.
+    """
+
+    def __init__(self, pages=10, rows=25, latency=0.0, tls=False, port=0, captcha=False, error_rate=0.0,
+                 max_rate=None, fixtures=None):
+        self.fixtures = fixtures
+        self.pages = pages
+        self.rows = rows
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_rate = max_rate
+        self.throttled = 0
+        self._recent = deque()  # times of the requests of the last second
+        self.captcha = captcha
+        self.requests = 0
+        self.solves = 0
+        self._captchas = {}  # token: text
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    throttled = server.max_rate is not None and server.over_rate()
+                if server.error_rate and random.random() < server.error_rate or throttled:
+                    self.send_response(429 if throttled else 503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                content_type = "text/html; charset=utf-8"
+                if url.path == "/threat_defence.php":
+                    return self.threat_defence(query)
+                elif url.path in ("/captcha.svg", "/logo.svg"):
+                    text = server._captchas.get(query.get("token"), "RARBG")
+                    body, content_type = make_captcha_svg(text).encode("utf-8"), "image/svg+xml"
+                elif server.captcha and f"{DEFENCE_COOKIE}=ok" not in self.headers.get("Cookie", ""):
+                    return self.redirect("/threat_defence.php?defence=1")
+                elif url.path.startswith("/torrent/"):
+                    body = server.detail_page(url.path.split("/")[-1])
+                elif url.path == "/download.php":
+                    body, content_type = make_torrent_file(query.get("id", "")), "application/x-bittorrent"
+                else:
+                    body = server.listing_page(int(query.get("page", "1")),
+                                               query.get("order") == "seeders" and query.get("by") == "DESC")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def threat_defence(self, query):
+                token = query.get("token")
+                if "solve_string" in query:
+                    if server._captchas.pop(token, None) == query["solve_string"].strip().upper():
+                        with server._lock:
+                            server.solves += 1
+                        return self.redirect("/torrents.php", f"{DEFENCE_COOKIE}=ok; Path=/")
+                    return self.redirect("/threat_defence.php?defence=1")
+                if token is None:
+                    token = f"{random.getrandbits(64):016x}"
+                    server._captchas[token] = "".join(random.choices(CAPTCHA_ALPHABET, k=5))
+                step = 2 if query.get("defence") == "2" else 1
+                if server.fixtures is not None:
+                    body = server.fixtures.threat_defence_page(step, token)
+                else:
+                    body = make_threat_defence_page(step, token).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def redirect(self, location, cookie=None):
+                self.send_response(302)
+                self.send_header("Location", location)
+                if cookie:
+                    self.send_header("Set-Cookie", cookie)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = QuietHTTPServer(("127.0.0.1", port), Handler)
+        self.scheme = "http"
+        self.cafile = None
+        if tls:
+            self.scheme = "https"
+            self.cafile = make_self_signed_cert()
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.cafile)
+            self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def domain(self):
+        return "%s:%s" % self.httpd.server_address[:2]
+
+    def listing_page(self, page_num, by_seeders=False):
+        """Listing page `page_num`, with `by_seeders` ordered by seeders (descending) across pages"""
+        if self.fixtures is not None:
+            return self.fixtures.listing_page(page_num)
+        seeders_from = (self.pages - page_num + 1) * self.rows if by_seeders else None
+        return make_listing_page(page_num, self.rows if page_num <= self.pages else 0,
+                                 seeders_from=seeders_from).encode("utf-8")
+
+    def detail_page(self, tid):
+        if self.fixtures is not None:
+            return self.fixtures.detail_page(tid)
+        return make_detail_page(tid).encode("utf-8")
+
+    def detail_url(self, tid):
+        return f"{self.scheme}://{self.domain}/torrent/{tid}"
+
+    def over_rate(self):
+        now = time.monotonic()
+        while self._recent and self._recent[0] < now - 1:
+            self._recent.popleft()
+        if len(self._recent) >= self.max_rate:
+            self.throttled += 1
+            return True
+        self._recent.append(now)
+        return False
+
+    @property
+    def threat_defence_url(self):
+        return f"{self.scheme}://{self.domain}/threat_defence.php?defence=1"
+
+    def listing_url(self, page_num):
+        return f"{self.scheme}://{self.domain}/torrents.php?search=bench&order=&category=&page={page_num}&by=ASC"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.cafile:
+            os.remove(self.cafile)
+
+
+class TorrentClientStandIn:
+    """Local stand-in of a torrent client's RPC: Transmission (/transmission/rpc, with its 409 session
+    id handshake) and qBittorrent's Web API (/api/v2/torrents/add). `added` lists the magnets
+    received, `calls` the RPC requests, each answered after `latency` seconds."""
+
+    SESSION_ID = "bench-session"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.added = []
+        self.calls = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with server._lock:
+                    server.calls += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                if self.path == "/transmission/rpc":
+                    if self.headers.get("X-Transmission-Session-Id") != server.SESSION_ID:
+                        return self.reply(409, b"", {"X-Transmission-Session-Id": server.SESSION_ID})
+                    request = json.loads(body)
+                    magnets = [request["arguments"]["filename"]] if request["method"] == "torrent-add" else []
+                    reply = json.dumps({"result": "success", "arguments": {"torrent-added": {}}}).encode()
+                elif self.path == "/api/v2/torrents/add":
+                    magnets = parse_qs(body.decode())["urls"][0].splitlines()
+                    reply = b"Ok."
+                else:
+                    return self.reply(404, b"")
+                with server._lock:
+                    server.added += magnets
+                self.reply(200, reply)
+
+            def reply(self, status, body, headers=()):
+                self.send_response(status)
+                for name, value in dict(headers).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = QuietHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, kind):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}" + ("/transmission/rpc" if kind == "transmission" else "")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def make_self_signed_cert():
+    """Create a self-signed certificate + key for 127.0.0.1 in a single PEM file"""
+    fd, path = tempfile.mkstemp(suffix=".pem", prefix="rarbgapi-bench-")
+    os.close(fd)
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+         "-keyout", path, "-out", path + ".crt"],
+        check=True, capture_output=True,
+    )
+    with open(path, "a") as pem, open(path + ".crt") as crt:
+        pem.write(crt.read())
+    os.remove(path + ".crt")
+    return path
+
+
+def unpaced():
+    """No request pacing: these benchmarks measure fetching itself (see `schedule` for pacing)"""
+    return rarbgapi.RequestScheduler(None)
+
+
+def crawl(server, concurrency):
+    """Walk the listing pages like search_for_torrent does, return number of torrents"""
+    found = 0
+    with rarbgapi.RarbgClient(pool_size=concurrency, scheduler=unpaced()) as client:
+        for _, _, html in rarbgapi.fetch_pages(server.listing_url, client, concurrency):
+            torrents = rarbgapi.parse_listing(html, server.domain)
+            if not torrents:
+                break
+            found += len(torrents)
+    return found
+
+
+def bench_pages(args):
+    print(f"{'concurrency':>12} {'seconds':>9} {'pages/s':>9} {'requests':>9} {'speedup':>8}")
+    baseline = None
+    for concurrency in args.concurrency:
+        with StandInServer(args.pages, args.rows, args.latency) as server:
+            start = time.perf_counter()
+            found = crawl(server, concurrency)
+            elapsed = time.perf_counter() - start
+            assert found == args.pages * args.rows, found
+            baseline = baseline or elapsed
+            print(f"{concurrency:>12} {elapsed:>9.3f} {(args.pages + 1) / elapsed:>9.1f} "
+                  f"{server.requests:>9} {baseline / elapsed:>7.2f}x")
+
+
+def bench_session(args):
+    """Bare requests.get per request (one TLS handshake each) vs the pooled RarbgClient"""
+    with StandInServer(pages=1, rows=args.rows, latency=args.latency, tls=True) as server:
+        url = server.listing_url(1)
+
+        def bare():
+            requests.get(url, headers=rarbgapi.ref.DEFAULT_HEADER, verify=server.cafile)
+
+        client = rarbgapi.RarbgClient(verify=server.cafile, scheduler=unpaced())
+        results = {}
+        for name, fetch in [("requests.get", bare), ("RarbgClient", lambda: client.get(url))]:
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                fetch()
+            results[name] = (time.perf_counter() - start) / args.requests
+        client.close()
+
+    print(f"{'fetch path':>14} {'ms/request':>11} {'speedup':>8}")
+    baseline = results["requests.get"]
+    for name, per_request in results.items():
+        print(f"{name:>14} {per_request * 1000:>11.2f} {baseline / per_request:>7.2f}x")
+
+
+def bench_details(args):
+    """Magnet resolution of `--torrents` detail pages: the old serial BeautifulSoup loop vs resolve_magnets"""
+    # Torrent hrefs are https, so this runs against the TLS stand-in
+    with StandInServer(latency=args.latency, tls=True) as server, \
+            rarbgapi.RarbgClient(pool_size=max(args.workers), verify=server.cafile, scheduler=unpaced()) as client:
+        def torrents():
+            return [rarbgapi.Torrent(str(i), None, f"/torrent/{i:08x}", server.domain, 0.0, "", 0, 0, 0, "")
+                    for i in range(args.torrents)]
+
+        def serial(todo):
+            for t in todo:
+                _, html_subpage = client.get_page_html(t.href)
+                parsed_html_subpage = BeautifulSoup(html_subpage, "html.parser")
+                t.resolved_magnet = parsed_html_subpage.select_one('a[href^="magnet:"]').get("href")
+
+        runs = [("serial+bs4", serial)]
+        runs += [(f"workers={workers}", partial(resolve, client, workers=workers)) for workers in args.workers]
+        print(f"{'resolver':>14} {'seconds':>9} {'speedup':>8}")
+        baseline = None
+        for name, run in runs:
+            todo = torrents()
+            start = time.perf_counter()
+            run(todo)
+            elapsed = time.perf_counter() - start
+            assert all(t.magnet.startswith("magnet:") for t in todo)
+            baseline = baseline or elapsed
+            print(f"{name:>14} {elapsed:>9.3f} {baseline / elapsed:>7.2f}x")
+
+
+def resolve(client, todo, workers):
+    failures = rarbgapi.resolve_magnets(client, todo, workers=workers)
+    assert not failures, failures
+
+
+def parse_listing_legacy(html, domain="rarbgunblocked.org"):
+    """The per-row findParent/select_one parser that parse_listing replaced, kept for comparison"""
+    parsed_html = BeautifulSoup(html, "html.parser")
+    torrents = parsed_html.select('tr.lista2 a[href^="/torrent/"][title]')
+    magnets = list(map(extract_magnet_legacy, torrents))
+    torrentfiles = list(map(partial(rarbgapi.extract_torrent_file, domain=domain), torrents))
+    return [
+        {
+            "title": torrent.get("title"),
+            "torrent": torrentfile,
+            "href": f"https://{domain}{torrent.get('href')}",
+            "date": datetime.datetime.strptime(
+                str(torrent.findParent("tr").select_one("td:nth-child(3)").contents[0]), "%Y-%m-%d %H:%M:%S"
+            ).timestamp(),
+            "category": rarbgapi.ref.CODE2CATEGORY.get(
+                torrent.findParent("tr").select_one("td:nth-child(1) img").get("src").split("/")[-1].replace("cat_new", "").replace(".gif", ""),
+                "UNKOWN",
+            ),
+            "size": rarbgapi.format_size(rarbgapi.parse_size(torrent.findParent("tr").select_one("td:nth-child(4)").contents[0])),
+            "seeders": int(torrent.findParent("tr").select_one("td:nth-child(5) > font").contents[0]),
+            "leechers": int(torrent.findParent("tr").select_one("td:nth-child(6)").contents[0]),
+            "uploader": str(torrent.findParent("tr").select_one("td:nth-child(8)").contents[0]),
+            "magnet": magnet,
+        }
+        for (torrent, magnet, torrentfile) in zip(torrents, magnets, torrentfiles)
+    ]
+
+
+def extract_magnet_legacy(anchor):
+    regex = r"over\/(.*)\.jpg\\"
+    try:
+        hash = re.search(regex, str(anchor))[1]
+        return f"magnet:?xt=urn:btih:{hash}&dn={quote(anchor.get('title'))}&tr={rarbgapi.MAGNET_TRACKERS}"
+    except Exception:
+        return ""
+
+
+def load_saved_pages(paths):
+    """Read saved listing pages, defaulting to the page archive (--archive) and older history/ dumps"""
+    pages = []
+    if not paths and os.path.exists(rarbgapi.ARCHIVE_PATH):
+        import archive_rarbgapi
+
+        with archive_rarbgapi.PageArchive(rarbgapi.ARCHIVE_PATH) as archive:
+            pages += [page["content"] for page in archive.pages() if b"lista2" in page["content"]]
+    paths = paths or sorted(glob.glob(os.path.join(rarbgapi.HISTORY_DIRECTORY, "*_torrents_*.html")))
+    for path in paths:
+        with open(path, "rb") as page:
+            html = page.read()
+        if b"lista2" in html:
+            pages.append(html)
+    return pages
+
+
+def bench_parse(args):
+    """Parse time per listing page for the legacy parser and each parse_listing backend"""
+    pages = load_saved_pages(args.pages)
+    if not pages:
+        print("No saved listing pages found, using generated ones")
+        pages = [make_listing_page(page_num).encode("utf-8") for page_num in range(1, 11)]
+
+    def legacy_dicts(torrents):
+        return [{k: v for k, v in t.to_dict().items() if k not in ("category_code", "size_bytes")} for t in torrents]
+
+    parsers = [("legacy", parse_listing_legacy)]
+    for backend in rarbgapi.LISTING_PARSERS[1:]:
+        try:
+            rarbgapi.parse_listing(pages[0], backend=backend)
+        except ImportError:
+            print(f"Skipping {backend}: not installed")
+            continue
+        parsers.append((backend, partial(rarbgapi.parse_listing, backend=backend)))
+
+    expected = [parse_listing_legacy(html) for html in pages]
+    print(f"{'parser':>12} {'ms/page':>9} {'speedup':>8}")
+    baseline = None
+    for name, parse in parsers:
+        parsed = [parse(html) for html in pages]
+        if name != "legacy":
+            parsed = list(map(legacy_dicts, parsed))
+        assert parsed == expected, name
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for html in pages:
+                parse(html)
+        per_page = (time.perf_counter() - start) / (args.repeat * len(pages))
+        baseline = baseline or per_page
+        print(f"{name:>12} {per_page * 1000:>9.3f} {baseline / per_page:>7.2f}x")
+
+
+def bench_sizes(args):
+    """Size column of a page: the legacy split/strip per cell, parse_size per cell and parse_sizes in bulk"""
+    rng = random.Random(0)
+    column = [f"{rng.uniform(1, 999):.2f} {rng.choice(['KB', 'MB', 'GB'])}" for _ in range(args.rows)]
+
+    def legacy(size):
+        number, unit = [string.strip() for string in size.strip().split()]
+        return int(float(number) * rarbgapi.ref.SIZE_UNITS[unit])
+
+    runs = [
+        ("legacy", lambda: [legacy(size) for size in column]),
+        ("parse_size", lambda: [rarbgapi.parse_size(size) for size in column]),
+        ("parse_sizes", lambda: rarbgapi.parse_sizes(column)),
+    ]
+    expected = runs[0][1]()
+    print(f"{'parser':>12} {'us/page':>9} {'speedup':>8}")
+    baseline = None
+    for name, run in runs:
+        assert run() == expected, name
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            run()
+        per_page = (time.perf_counter() - start) / args.repeat
+        baseline = baseline or per_page
+        print(f"{name:>12} {per_page * 1e6:>9.2f} {baseline / per_page:>7.2f}x")
+
+
+def bench_mirrors(args):
+    """Crawl through a pool of a down, a slow and a fast mirror, then lose the fast one halfway"""
+    import mirrors_rarbgapi
+
+    latencies = [args.latency * 10, args.latency * 2, args.latency]
+    servers = [StandInServer(args.pages, args.rows, latency) for latency in latencies]
+    for server in servers:
+        server.__enter__()
+    down, slow, fast = servers
+    down.error_rate = 1.0
+    names = {down.domain: "down", slow.domain: "slow", fast.domain: "fast"}
+
+    def run(domains, fail_fast_after=None):
+        for server in servers:
+            server.requests = 0
+        pool = mirrors_rarbgapi.MirrorPool(domains) if len(domains) > 1 else None
+        found = 0
+        start = time.perf_counter()
+        with rarbgapi.RarbgClient(pool_size=args.concurrency, mirrors=pool, retries=1, backoff=0,
+                                 scheduler=unpaced()) as client:
+            if pool is not None:
+                client.probe_mirrors("http")
+            page_url = down.listing_url if pool is not None else slow.listing_url
+            for page_num, page, html in rarbgapi.fetch_pages(page_url, client, args.concurrency):
+                if page_num == fail_fast_after:
+                    fast.error_rate = 1.0
+                torrents = rarbgapi.parse_listing(html, urlparse(page.url).netloc)
+                if not torrents:
+                    break
+                found += len(torrents)
+        elapsed = time.perf_counter() - start
+        fast.error_rate = 0.0
+        served = " ".join(f"{names[server.domain]}={server.requests}" for server in servers)
+        return elapsed, found, served
+
+    print(f"{'run':>16} {'seconds':>9} {'torrents':>9}  requests per mirror")
+    try:
+        for name, domains, fail_after in [
+            ("slow only", [slow.domain], None),
+            ("pool", [down.domain, slow.domain, fast.domain], None),
+            ("pool, fast dies", [down.domain, slow.domain, fast.domain], args.pages // 2),
+        ]:
+            elapsed, found, served = run(domains, fail_after)
+            assert found == args.pages * args.rows, (name, found)
+            print(f"{name:>16} {elapsed:>9.3f} {found:>9}  {served}")
+    finally:
+        for server in servers:
+            server.__exit__()
+
+
+def bench_schedule(args):
+    """Listing pages and detail pages at once against a stand-in that throttles past --max_rate requests/s"""
+    import asyncio
+    import client_rarbgapi
+    import scheduler_rarbgapi
+
+    async def workload(server, scheduler):
+        async with client_rarbgapi.AsyncRarbgClient(pool_size=16, retries=8, backoff=0.05, verify=server.cafile,
+                                                    scheduler=scheduler) as client:
+            start = time.perf_counter()
+
+            async def listing():
+                async for _, _, html in client.fetch_pages(server.listing_url, 4):
+                    if not rarbgapi.parse_listing(html, server.domain):
+                        break
+                return time.perf_counter() - start
+
+            torrents = [rarbgapi.Torrent(str(i), None, f"/torrent/{i:08x}", server.domain, 0.0, "", 0, 0, 0, "")
+                        for i in range(args.torrents)]
+            listing_done, failures = await asyncio.gather(listing(), client.resolve_magnets(torrents, 8))
+            return listing_done, time.perf_counter() - start, len(failures), scheduler.rates().get(server.domain)
+
+    print(f"{'scheduler':>10} {'listing s':>10} {'total s':>8} {'429s':>6} {'failed':>7} {'rate/s':>7}")
+    for name, scheduler in [("unpaced", scheduler_rarbgapi.RequestScheduler(None)),
+                            ("adaptive", scheduler_rarbgapi.RequestScheduler(args.rate, args.max_rate * 2))]:
+        with StandInServer(args.pages, latency=args.latency, tls=True, max_rate=args.max_rate) as server:
+            listing_done, total, failed, rate = asyncio.run(workload(server, scheduler))
+            rate = "-" if rate is None else f"{rate:.1f}"
+            print(f"{name:>10} {listing_done:>10.3f} {total:>8.3f} {server.throttled:>6} {failed:>7} {rate:>7}")
+
+
+def bench_filter(args):
+    """--min_seeders on a listing ordered by seeders: filtering after the crawl vs while streaming, with early stop"""
+    import filter_rarbgapi
+
+    where = filter_rarbgapi.TorrentFilter(min_seeders=args.min_seeders)
+    print(f"{'run':>16} {'seconds':>9} {'requests':>9} {'matches':>8}")
+    for name, streaming in [("filter after", False), ("streaming", True)]:
+        # search_url is https, so this runs against the TLS stand-in
+        with StandInServer(args.pages, args.rows, args.latency, tls=True) as server, \
+                rarbgapi.RarbgClient(pool_size=args.concurrency, verify=server.cafile, scheduler=unpaced()) as client:
+            start = time.perf_counter()
+            torrents = client.iter_torrents("bench", domain=server.domain, order="seeders", descending=True,
+                                            concurrency=args.concurrency, where=where if streaming else None)
+            matches = list(filter(where, torrents))
+            elapsed = time.perf_counter() - start
+            assert len(matches) == args.pages * args.rows - args.min_seeders + 1, len(matches)
+            print(f"{name:>16} {elapsed:>9.3f} {server.requests:>9} {len(matches):>8}")
+
+
+def bench_download(args):
+    """.torrent files into a directory and magnets to the RPC stand-ins, one at a time vs in parallel"""
+    import download_rarbgapi
+
+    print(f"{'sink':>14} {'workers':>8} {'seconds':>9} {'sent':>5} {'skipped':>8} {'calls':>6}")
+    with StandInServer(latency=args.latency, tls=True) as server, TorrentClientStandIn(args.latency) as rpc, \
+            tempfile.TemporaryDirectory() as directory, \
+            rarbgapi.RarbgClient(pool_size=max(args.workers), verify=server.cafile, scheduler=unpaced()) as client:
+        # every torrent twice, as the old pipeline sent them
+        torrents = rarbgapi.parse_listing(server.listing_page(1), server.domain)[:args.torrents]
+        torrents = torrents + [rarbgapi.Torrent.from_record(t.to_record()) for t in torrents]
+        # rows without an info-hash: the .torrent URL is known, no detail page is needed for them
+        hashless = [rarbgapi.Torrent.from_record(t.to_record()) for t in torrents]
+        for torrent in hashless:
+            torrent.info_hash = ""
+        for name, sink, batch in [
+                ("files", download_rarbgapi.TorrentFileSink(directory), torrents),
+                ("files, no hash", download_rarbgapi.TorrentFileSink(os.path.join(directory, "hashless")), hashless),
+                ("transmission", download_rarbgapi.TransmissionSink(rpc.url("transmission")), torrents),
+                ("qbittorrent", download_rarbgapi.QBittorrentSink(rpc.url("qbittorrent")), torrents)]:
+            for workers in args.workers:
+                rpc.calls = server.requests = 0
+                start = time.perf_counter()
+                report = client.download(batch, sink, workers)
+                elapsed = time.perf_counter() - start
+                assert report and len(report.sent) == len(batch) // 2, str(report)
+                calls = server.requests if name.startswith("files") else rpc.calls
+                if name.startswith("files"):
+                    assert calls == len(batch) // 2, f"{calls} requests for {len(batch) // 2} .torrent files"
+                print(f"{name:>14} {workers:>8} {elapsed:>9.3f} {len(report.sent):>5} {len(report.skipped):>8} {calls:>6}")
+        assert len(os.listdir(directory)) == len(torrents) // 2 + 1  # and the hashless directory
+
+
+def bench_coalesce(args):
+    """Identical searches started at the same time: one request each vs coalesced while in flight"""
+    print(f"{'run':>10} {'seconds':>9} {'requests':>9} {'coalesced':>10}")
+    for name, coalesce in [("separate", False), ("coalesced", True)]:
+        with StandInServer(args.pages, args.rows, args.latency, tls=True) as server, \
+                rarbgapi.RarbgClient(pool_size=args.searches * args.concurrency, verify=server.cafile,
+                                     scheduler=unpaced(), coalesce=coalesce) as client:
+            start = time.perf_counter()
+            results = list(client.search_batch([{"search": "bench"}] * args.searches, args.searches,
+                                               domain=server.domain, concurrency=args.concurrency))
+            elapsed = time.perf_counter() - start
+            assert all(torrents is not None and len(torrents) == args.pages * args.rows for _, torrents, _ in results)
+            # only fetches in flight at the same time are shared, so how many depends on timing:
+            # reported, not asserted
+            coalesced = client.aclient.metrics.summary()["counters"].get("coalesced_fetches", 0)
+            print(f"{name:>10} {elapsed:>9.3f} {server.requests:>9} {coalesced:>10}")
+
+
+def bench_export(args):
+    """A large crawl written as indented JSON (all records at once) vs streamed to the columnar exporters"""
+    import csv
+    import export_rarbgapi
+
+    page = rarbgapi.parse_listing(make_listing_page(1, 100).encode("utf-8"), "rarbg.to")
+
+    def crawl():
+        # fresh records, as a crawl parses them page after page
+        for i in range(args.rows):
+            torrent = rarbgapi.Torrent.from_record(page[i % len(page)].to_record())
+            torrent.title = f"{torrent.title}.{i}"
+            yield torrent
+
+    def write_json(path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps([t.to_dict() for t in crawl()], indent=4))
+
+    def write_export(path):
+        with export_rarbgapi.Exporter(path, batch_size=args.batch) as exporter:
+            exporter.write_all(crawl())
+
+    def load(path):
+        if path.endswith(".json"):
+            with open(path, encoding="utf-8") as f:
+                return len(json.load(f))
+        if path.endswith(".csv"):
+            with open(path, newline="", encoding="utf-8") as f:
+                return sum(1 for _ in csv.reader(f)) - 1
+        import pyarrow
+        import pyarrow.parquet
+
+        if path.endswith(".parquet"):
+            return pyarrow.parquet.read_table(path).num_rows
+        return pyarrow.ipc.open_file(path).read_all().num_rows
+
+    runs = [("json", write_json, ".json"), ("csv", write_export, ".csv")]
+    if export_rarbgapi._pyarrow() is not None:
+        runs += [("parquet", write_export, ".parquet"), ("arrow", write_export, ".arrow")]
+    else:
+        print("pyarrow isn't installed, only CSV is compared")
+    print(f"{'format':>8} {'write s':>8} {'peak MB':>8} {'file MB':>8} {'load s':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, write, extension in runs:
+            path = os.path.join(directory, "crawl" + extension)
+            write_seconds = timed(args.repeat, partial(write, path))
+            tracemalloc.start()
+            write(path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            start = time.perf_counter()
+            assert load(path) == args.rows
+            load_seconds = time.perf_counter() - start
+            print(f"{name:>8} {write_seconds:>8.3f} {peak / 1e6:>8.1f} {os.path.getsize(path) / 1e6:>8.1f} "
+                  f"{load_seconds:>8.3f}")
+
+
+def missing_captcha_module():
+    """The first module CaptchaSolver needs that isn't installed, or None"""
+    for module in ("selenium", "pytesseract", "PIL"):
+        try:
+            __import__(module)
+        except ImportError:
+            return module
+    return None
+
+
+def bench_captcha(args):
+    """Threat defence solves against the stand-in CAPTCHA: a fresh browser per challenge vs the warm solver"""
+    missing = missing_captcha_module()
+    if missing:
+        print(f"Skipping: {missing} not installed (needs Chrome and tesseract too)")
+        return
+    import captcha_rarbgapi
+
+    def cold(url):
+        solver = captcha_rarbgapi.CaptchaSolver()
+        try:
+            return solver.solve(url)
+        finally:
+            solver.close()
+
+    warm_solver = captcha_rarbgapi.CaptchaSolver()
+    print(f"{'solver':>8} {'s/solve':>9} {'solved':>7} {'speedup':>8}")
+    baseline = None
+    try:
+        for name, solve in [("cold", cold), ("warm", warm_solver.solve)]:
+            with StandInServer(captcha=True) as server:
+                start = time.perf_counter()
+                for _ in range(args.challenges):
+                    solve(server.threat_defence_url)
+                per_solve = (time.perf_counter() - start) / args.challenges
+                baseline = baseline or per_solve
+                print(f"{name:>8} {per_solve:>9.3f} {server.solves:>3}/{args.challenges:<3} {baseline / per_solve:>7.2f}x")
+    finally:
+        warm_solver.close()
+
+
+def write_fixture(directory, fname, html):
+    with open(os.path.join(directory, fname), "wb") as page:
+        page.write(html if isinstance(html, bytes) else html.encode("utf-8"))
+
+
+def record(args):
+    """Write fixtures for `suite --fixtures`: pages of a live search, or generated ones with --generate"""
+    os.makedirs(args.directory, exist_ok=True)
+    if args.generate:
+        for page_num in range(1, args.pages + 2):  # and the empty page ending the search
+            html = make_listing_page(page_num, args.rows if page_num <= args.pages else 0)
+            write_fixture(args.directory, f"listing_{page_num}.html", html)
+        for torrent in rarbgapi.parse_listing(make_listing_page(1, args.rows))[:args.details]:
+            tid = torrent.path.split("/")[-1]
+            write_fixture(args.directory, f"detail_{tid}.html", make_detail_page(tid))
+        for step in (1, 2):
+            write_fixture(args.directory, f"threat_defence_{step}.html", make_threat_defence_page(step, "0" * 16))
+        print(f"Generated {args.pages + 1} listing pages and {args.details} detail pages in {args.directory}")
+        return
+
+    if not args.search:
+        sys.exit("record needs --search (or --generate)")
+    # the site answers with threat_defence.php when not solved yet, record that too
+    defence = requests.get(f"https://{args.domain}/threat_defence.php?defence=1",
+                           headers=rarbgapi.ref.DEFAULT_HEADER, timeout=30)
+    write_fixture(args.directory, "threat_defence_1.html", defence.content)
+    torrents = []
+    with rarbgapi.RarbgClient(rarbgapi.load_cookies(False, args.domain), scheduler=rarbgapi.RequestScheduler(2)) as client:
+        for page_num in range(1, args.pages + 1):
+            _, html = client.get_page_html(rarbgapi.search_url(args.search, domain=args.domain, page=page_num))
+            write_fixture(args.directory, f"listing_{page_num}.html", html)
+            page_torrents = rarbgapi.parse_listing(html, args.domain)
+            if not page_torrents:
+                break
+            torrents += page_torrents
+        for torrent in torrents[:args.details]:
+            _, html = client.get_page_html(torrent.href)
+            write_fixture(args.directory, f"detail_{torrent.path.split('/')[-1]}.html", html)
+    print(f"Recorded {page_num} listing pages and {min(len(torrents), args.details)} detail pages in {args.directory}")
+
+
+# name: (unit, higher is better) of the metrics `suite` records
+SUITE_METRICS = {
+    "search_seconds": ("s", False),
+    "pages_per_second": ("pages/s", True),
+    "search_requests": ("requests", False),
+    "peak_memory_bytes": ("bytes", False),
+    "resolve_seconds": ("s", False),
+    "resolve_requests": ("requests", False),
+    "detail_parse_ms_per_page": ("ms", False),
+    "captcha_seconds_per_solve": ("s", False),
+}
+SUITE_METRICS.update({f"parse_ms_per_page.{backend}": ("ms", False) for backend in rarbgapi.LISTING_PARSERS[1:]})
+
+
+def git_commit():
+    """(commit hash, uncommitted changes?) of the checkout, or (None, None) outside of git"""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=cwd, capture_output=True, text=True, check=True)
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=cwd,
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.stdout.strip(), bool(status.stdout.strip())
+
+
+def timed(repeat, run):
+    """Median seconds of `repeat` calls of `run`"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def run_suite(args, fixtures):
+    metrics = {}
+    with StandInServer(args.pages, args.rows, args.latency, tls=True, fixtures=fixtures) as server:
+        listing_pages = fixtures.pages if fixtures else [server.listing_page(n) for n in range(1, args.pages + 1)]
+        found = sum(len(rarbgapi.parse_listing(html, server.domain)) for html in listing_pages)
+
+        def search():
+            with rarbgapi.RarbgClient(pool_size=args.concurrency, verify=server.cafile, scheduler=unpaced()) as client:
+                torrents = client.search("bench", domain=server.domain, concurrency=args.concurrency)
+            assert len(torrents) == found, (len(torrents), found)
+
+        search()  # warm up (certificates, imports)
+        server.requests = 0
+        metrics["search_seconds"] = timed(args.repeat, search)
+        metrics["search_requests"] = server.requests // args.repeat
+        metrics["pages_per_second"] = metrics["search_requests"] / metrics["search_seconds"]
+
+        tracemalloc.start()
+        search()
+        metrics["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        with rarbgapi.RarbgClient(pool_size=args.workers, verify=server.cafile, scheduler=unpaced()) as client:
+            tids = list(fixtures.detail) if fixtures and fixtures.detail else [f"{i:08x}" for i in range(args.details)]
+            tids = (tids * args.details)[:args.details]
+
+            def resolve_details():
+                todo = [rarbgapi.Torrent(str(i), None, f"/torrent/{tid}", server.domain, 0.0, "", 0, 0, 0, "")
+                        for i, tid in enumerate(tids)]
+                resolve(client, todo, args.workers)
+
+            server.requests = 0
+            metrics["resolve_seconds"] = timed(args.repeat, resolve_details)
+            metrics["resolve_requests"] = server.requests // args.repeat
+        detail_pages = [server.detail_page(tid) for tid in tids]
+
+    for backend in rarbgapi.LISTING_PARSERS[1:]:
+        try:
+            rarbgapi.parse_listing(listing_pages[0], backend=backend)
+        except ImportError:
+            continue
+        seconds = timed(args.repeat, lambda: [rarbgapi.parse_listing(html, backend=backend) for html in listing_pages])
+        metrics[f"parse_ms_per_page.{backend}"] = seconds * 1000 / len(listing_pages)
+    seconds = timed(args.repeat, lambda: [rarbgapi.extract_detail_links(html) for html in detail_pages])
+    metrics["detail_parse_ms_per_page"] = seconds * 1000 / len(detail_pages)
+
+    if args.captcha and missing_captcha_module() is None:
+        import captcha_rarbgapi
+
+        solver = captcha_rarbgapi.CaptchaSolver()
+        try:
+            with StandInServer(captcha=True, fixtures=fixtures) as server:
+                metrics["captcha_seconds_per_solve"] = timed(args.repeat, lambda: solver.solve(server.threat_defence_url))
+        finally:
+            solver.close()
+    return metrics
+
+
+def compare(metrics, baseline, tolerance):
+    """Print the metrics next to the baseline ones, return the names of those that got worse than `tolerance`"""
+    regressions = []
+    print(f"{'metric':>34} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, value in metrics.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        change = value / before - 1
+        worse = -change if SUITE_METRICS[name][1] else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:>34} {before:>12.4g} {value:>12.4g} {change:>+7.1%}{flag}")
+    return regressions
+
+
+def bench_suite(args):
+    """Every end-to-end metric in one run, written as JSON (--output) and compared to earlier results (--compare)"""
+    fixtures = Fixtures(args.fixtures) if args.fixtures else None
+    metrics = run_suite(args, fixtures)
+    commit, dirty = git_commit()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("func", "benchmark", "output", "compare")},
+        "metrics": metrics,
+    }
+
+    print(f"{'metric':>34} {'value':>12}  unit")
+    for name, value in metrics.items():
+        print(f"{name:>34} {value:>12.4g}  {SUITE_METRICS[name][0]}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+            output.write("\n")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"\nAgainst {args.compare} ({baseline.get('commit') or 'unknown commit'}):")
+        regressions = compare(metrics, baseline["metrics"], args.tolerance)
+        if regressions:
+            print("FAIL regressed past", f"{args.tolerance:.0%}:", ", ".join(regressions))
+            sys.exit(1)
+
+
+# what `import rarbgapi` must not load, the code paths that need them import them
+HEAVY_MODULES = ["aiohttp", "argparse", "asyncio", "bs4", "lxml", "PIL", "pytesseract", "requests",
+                 "selectolax", "selenium", "sqlite3", "ssl", "tqdm", "wget"]
+
+
+def import_profile(module, home):
+    """Import `module` in a fresh interpreter with -X importtime.
+
+    Return (microseconds the import took, {module it imported: cumulative microseconds}).
+    """
+    env = dict(os.environ, RARBGAPI_HOME=home)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            capture_output=True, text=True, check=True)
+    # -X importtime lists every import after the ones it triggered, nested ones indented
+    nested = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, total, name = line.split("|")
+        if name.strip() == module:
+            return int(total), nested
+        nested[name.strip()] = int(total)
+        if name[1:] == name.lstrip():  # top level import of the interpreter startup
+            nested = {}
+    raise RuntimeError(f"{module} not in -X importtime output")
+
+
+def bench_startup(args):
+    """Fail when `import rarbgapi` is over budget, pulls in a heavy module or creates files"""
+    with tempfile.TemporaryDirectory() as home:
+        runs = [import_profile("rarbgapi", home) for _ in range(args.repeat)]
+        created = os.listdir(home)
+    best, cumulative = min(runs, key=lambda run: run[0])
+    heavy = [name for name in cumulative if name.split(".")[0] in HEAVY_MODULES]
+
+    print(f"import rarbgapi: {best / 1000:.1f} ms (best of {args.repeat}, budget {args.budget} ms)")
+    for name, took in sorted(cumulative.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:>30} {took / 1000:>7.1f} ms")
+    failures = []
+    if best / 1000 > args.budget:
+        failures.append(f"over budget: {best / 1000:.1f} ms > {args.budget} ms")
+    if heavy:
+        failures.append("heavy modules imported: " + ", ".join(heavy))
+    if created:
+        failures.append("files created on import: " + ", ".join(created))
+    for failure in failures:
+        print("FAIL", failure)
+    if failures:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    pages = subparsers.add_parser("pages", help="sequential vs concurrent listing page crawl")
+    pages.add_argument("--pages", type=int, default=20, help="non-empty pages served")
+    pages.add_argument("--rows", type=int, default=25, help="torrents per page")
+    pages.add_argument("--latency", type=float, default=0.1, help="seconds of server latency per request")
+    pages.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    pages.set_defaults(func=bench_pages)
+
+    session = subparsers.add_parser("session", help="per-request latency over HTTPS, bare vs pooled session")
+    session.add_argument("--requests", type=int, default=200, help="sequential requests per fetch path")
+    session.add_argument("--rows", type=int, default=25, help="torrents in the served page")
+    session.add_argument("--latency", type=float, default=0.0, help="seconds of server latency per request")
+    session.set_defaults(func=bench_session)
+
+    details = subparsers.add_parser("details", help="magnet resolution from detail pages, serial vs batched")
+    details.add_argument("--torrents", type=int, default=50, help="detail pages to resolve")
+    details.add_argument("--latency", type=float, default=0.1, help="seconds of server latency per request")
+    details.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    details.set_defaults(func=bench_details)
+
+    parse = subparsers.add_parser("parse", help="listing page parse time per backend")
+    parse.add_argument("pages", nargs="*", help="saved listing pages (default: the page archive and the old history/ dumps)")
+    parse.add_argument("--repeat", type=int, default=20, help="times to parse every page")
+    parse.set_defaults(func=bench_parse)
+
+    sizes = subparsers.add_parser("sizes", help="size column parsing, per cell vs in bulk")
+    sizes.add_argument("--rows", type=int, default=25, help="cells in the column (torrents per page)")
+    sizes.add_argument("--repeat", type=int, default=20000, help="columns parsed")
+    sizes.set_defaults(func=bench_sizes)
+
+    mirrors = subparsers.add_parser("mirrors", help="mirror pool selection and failover (down, slow and fast stand-ins)")
+    mirrors.add_argument("--pages", type=int, default=20, help="non-empty pages served")
+    mirrors.add_argument("--rows", type=int, default=25, help="torrents per page")
+    mirrors.add_argument("--latency", type=float, default=0.02, help="seconds of latency of the fast mirror")
+    mirrors.add_argument("--concurrency", type=int, default=4)
+    mirrors.set_defaults(func=bench_mirrors)
+
+    schedule = subparsers.add_parser("schedule", help="unpaced vs adaptive scheduling against a throttling stand-in")
+    schedule.add_argument("--pages", type=int, default=10, help="non-empty listing pages served")
+    schedule.add_argument("--torrents", type=int, default=100, help="detail pages resolved meanwhile")
+    schedule.add_argument("--latency", type=float, default=0.02, help="seconds of server latency per request")
+    schedule.add_argument("--max_rate", type=int, default=30, help="requests/s the stand-in serves before answering 429")
+    schedule.add_argument("--rate", type=float, default=8, help="starting rate of the adaptive scheduler")
+    schedule.set_defaults(func=bench_schedule)
+
+    filtering = subparsers.add_parser("filter", help="numeric filter on a seeders ordered listing, with and without early stop")
+    filtering.add_argument("--pages", type=int, default=20, help="non-empty pages served")
+    filtering.add_argument("--rows", type=int, default=25, help="torrents per page")
+    filtering.add_argument("--min_seeders", type=int, default=300, help="seeders filter (the stand-in counts down from pages*rows)")
+    filtering.add_argument("--latency", type=float, default=0.05, help="seconds of server latency per request")
+    filtering.add_argument("--concurrency", type=int, default=4)
+    filtering.set_defaults(func=bench_filter)
+
+    downloads = subparsers.add_parser("download", help="download pipeline: .torrent files and RPC stand-ins")
+    downloads.add_argument("--torrents", type=int, default=25, help="torrents to download (each listed twice)")
+    downloads.add_argument("--latency", type=float, default=0.05, help="seconds of server latency per request")
+    downloads.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    downloads.set_defaults(func=bench_download)
+
+    coalescing = subparsers.add_parser("coalesce", help="identical concurrent searches, with and without coalescing")
+    coalescing.add_argument("--searches", type=int, default=8, help="identical searches started at once")
+    coalescing.add_argument("--pages", type=int, default=5, help="non-empty pages served")
+    coalescing.add_argument("--rows", type=int, default=25, help="torrents per page")
+    coalescing.add_argument("--latency", type=float, default=0.1, help="seconds of server latency per request")
+    coalescing.add_argument("--concurrency", type=int, default=2)
+    coalescing.set_defaults(func=bench_coalesce)
+
+    exporting = subparsers.add_parser("export", help="a large crawl as indented JSON vs Parquet, Arrow and CSV exports")
+    exporting.add_argument("--rows", type=int, default=50000, help="torrents in the crawl")
+    exporting.add_argument("--batch", type=int, default=10000, help="rows per exported batch")
+    exporting.add_argument("--repeat", type=int, default=3, help="writes to take the median of")
+    exporting.set_defaults(func=bench_export)
+
+    captcha = subparsers.add_parser("captcha", help="CAPTCHA solves, fresh browser vs warm solver (needs Chrome)")
+    captcha.add_argument("--challenges", type=int, default=5, help="challenges solved per solver")
+    captcha.set_defaults(func=bench_captcha)
+
+    suite = subparsers.add_parser("suite", help="end-to-end metrics as JSON, optionally compared to an earlier run")
+    suite.add_argument("--fixtures", help="directory of recorded pages to replay (see record), default generated pages")
+    suite.add_argument("--pages", type=int, default=10, help="non-empty pages served (generated pages only)")
+    suite.add_argument("--rows", type=int, default=25, help="torrents per page (generated pages only)")
+    suite.add_argument("--details", type=int, default=50, help="detail pages to resolve")
+    suite.add_argument("--latency", type=float, default=0.02, help="seconds of server latency per request")
+    suite.add_argument("--concurrency", type=int, default=4, help="listing pages fetched at once")
+    suite.add_argument("--workers", type=int, default=8, help="detail pages fetched at once")
+    suite.add_argument("--repeat", type=int, default=5, help="runs per metric (the median is kept)")
+    suite.add_argument("--captcha", action="store_true", help="time CAPTCHA solves too (needs Chrome)")
+    suite.add_argument("--output", "-o", help="JSON file to write the results to")
+    suite.add_argument("--compare", help="JSON results of an earlier run: exit 1 when a metric regressed")
+    suite.add_argument("--tolerance", type=float, default=0.10, help="relative change --compare lets pass")
+    suite.set_defaults(func=bench_suite)
+
+    recorder = subparsers.add_parser("record", help="save listing, detail and threat defence pages as fixtures")
+    recorder.add_argument("directory")
+    recorder.add_argument("--search", help="search to record the pages of")
+    recorder.add_argument("--domain", default="rarbgunblocked.org")
+    recorder.add_argument("--generate", action="store_true", help="write generated pages instead (offline)")
+    recorder.add_argument("--pages", type=int, default=10, help="listing pages at most")
+    recorder.add_argument("--rows", type=int, default=25, help="torrents per generated page")
+    recorder.add_argument("--details", type=int, default=10, help="detail pages to record")
+    recorder.set_defaults(func=record)
+
+    startup = subparsers.add_parser("startup", help="import time budget of rarbgapi (exits 1 when over)")
+    startup.add_argument("--budget", type=float, default=50, help="milliseconds `import rarbgapi` may take")
+    startup.add_argument("--repeat", type=int, default=5, help="imports to take the best of")
+    startup.add_argument("--top", type=int, default=8, help="slowest imported modules to list")
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
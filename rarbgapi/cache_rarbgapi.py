@@ -0,0 +1,165 @@
+"""On-disk cache of parsed listing pages with a TTL per entry and LRU eviction, and watch state"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+def query_key(search, category="", order="", descending=False, page=None, **extra):
+    """Normalized key of a query (or of one of its listing pages): same query, same key"""
+    return json.dumps(
+        {
+            "search": " ".join(search.casefold().split()),
+            "category": category or "",
+            "order": order or "",
+            "by": "DESC" if descending else "ASC",
+            **({} if page is None else {"page": int(page)}),
+            **{k: v for k, v in sorted(extra.items()) if v is not None},
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+
+
+def key_filename(key):
+    return hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json"
+
+
+def atomic_write(path, data):
+    """Write `data` (bytes) to `path` through a temporary file and an atomic rename"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class ResultCache:
+    """Directory of JSON entries, one file per key.
+
+    Entries older than `ttl` seconds are misses (and get deleted). When the cache grows
+    past `max_entries` files or `max_bytes` bytes the least recently used entries are
+    evicted; recency is the file mtime, which is touched on every hit so it is shared
+    between processes. Writes go to a temporary file that is atomically renamed.
+    """
+
+    def __init__(self, directory, ttl=3600, max_entries=2000, max_bytes=100 * 10**6):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._index = None  # {fname: [last_used, size]}
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key_filename(key))
+
+    def _load_index(self):
+        if self._index is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._index = {}
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".json"):
+                        stat = entry.stat()
+                        self._index[entry.name] = [stat.st_mtime, stat.st_size]
+        return self._index
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss"""
+        path = self._path(key)
+        with self._lock:
+            index = self._load_index()
+            try:
+                with open(path, "r", encoding="utf-8") as entry_file:
+                    entry = json.load(entry_file)
+            except FileNotFoundError:
+                index.pop(os.path.basename(path), None)
+                return None
+            except (OSError, ValueError) as e:
+                logging.warning("Dropping unreadable cache entry %s: %s", path, e)
+                self._remove(path)
+                return None
+
+            if entry.get("key") != key or time.time() - entry.get("created", 0) > self.ttl:
+                self._remove(path)
+                return None
+            now = time.time()
+            os.utime(path, (now, now))
+            index.setdefault(os.path.basename(path), [now, os.path.getsize(path)])[0] = now
+            return entry["value"]
+
+    def put(self, key, value):
+        path = self._path(key)
+        data = json.dumps({"key": key, "created": time.time(), "value": value}, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            index = self._load_index()
+            atomic_write(path, data)
+            index[os.path.basename(path)] = [time.time(), len(data)]
+            self._evict()
+
+    def _remove(self, path):
+        self._index.pop(os.path.basename(path), None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        total = sum(size for _, size in self._index.values())
+        if len(self._index) <= self.max_entries and total <= self.max_bytes:
+            return
+        for fname, (_, size) in sorted(self._index.items(), key=lambda item: item[1][0]):
+            if len(self._index) <= self.max_entries and total <= self.max_bytes:
+                break
+            self._remove(os.path.join(self.directory, fname))
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            for fname in list(self._load_index()):
+                self._remove(os.path.join(self.directory, fname))
+
+
+class WatchState:
+    """What previous watch runs of one query have already seen.
+
+    Remembers the keys (info-hashes) of the last `max_seen` torrents emitted, in one
+    JSON file per query under `directory`.
+    """
+
+    def __init__(self, directory, key, max_seen=10000):
+        self.path = os.path.join(directory, key_filename(key))
+        self.key = key
+        self.max_seen = max_seen
+        self._seen = {}  # insertion ordered, oldest first
+        try:
+            with open(self.path, "r", encoding="utf-8") as state_file:
+                state = json.load(state_file)
+            self._seen = dict.fromkeys(state["seen"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning("Ignoring unreadable watch state %s: %s", self.path, e)
+
+    def __contains__(self, key):
+        return key in self._seen
+
+    def __len__(self):
+        return len(self._seen)
+
+    def add(self, key):
+        self._seen[key] = None
+        while len(self._seen) > self.max_seen:
+            del self._seen[next(iter(self._seen))]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = {"key": self.key, "seen": list(self._seen)}
+        atomic_write(self.path, json.dumps(data).encode("utf-8"))
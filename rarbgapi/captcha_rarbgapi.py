@@ -0,0 +1,422 @@
+"""Threat defence (CAPTCHA) solving and the cookies it earns
+
+selenium, pytesseract and PIL are only imported when a CAPTCHA actually has to be solved,
+the browser that solves them is started once and reused (see CaptchaSolver).
+"""
+import atexit
+import base64
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+from sys import platform
+import threading
+import time
+from urllib.parse import urlsplit
+
+from metrics_rarbgapi import Metrics
+from paths_rarbgapi import COOKIES_PATH, PROGRAM_HOME
+
+
+def download_tesseract(chdir="."):
+    import zipfile
+    import wget
+
+    os.makedirs(chdir, exist_ok=True)
+    os.chdir(chdir)
+
+    # download for each platform if statement
+    if platform == "win32":
+        tesseract_zip = wget.download("https://github.com/FarisHijazi/rarbgcli/releases/download/v0.0.7/Tesseract-OCR.zip", "Tesseract-OCR.zip")
+        # extract the zip file
+        with zipfile.ZipFile(tesseract_zip, "r") as zip_ref:
+            zip_ref.extractall()  # you can specify the destination folder path here
+        # delete the zip file downloaded above
+        os.remove(tesseract_zip)
+    elif platform in ["linux", "linux2"]:
+        os.system("sudo apt-get install tesseract-ocr")
+    elif platform == "posix":
+        # TODO: Ensure system has brew installed
+        os.system("brew install tesseract")
+    else:
+        raise SystemError("Unsupported platform")
+
+def cookies_txt_to_dict(cookies_txt: str) -> dict:
+    from http.cookies import SimpleCookie
+
+    # SimpleCookie.load = lambda self, data: self.__init__(data.split(';'))
+    cookie = SimpleCookie()
+    cookie.load(cookies_txt)
+    return {k: v.value for k, v in cookie.items()}
+
+def cookies_dict_to_txt(cookies_dict: dict) -> str:
+    return "; ".join(f"{k}={v}" for k, v in cookies_dict.items())
+
+# reads the loaded CAPTCHA <img> back as PNG (base64) without requesting it again
+IMAGE_PNG_JS = """
+const image = arguments[0];
+const canvas = document.createElement("canvas");
+canvas.width = image.naturalWidth;
+canvas.height = image.naturalHeight;
+canvas.getContext("2d").drawImage(image, 0, 0);
+return canvas.toDataURL("image/png").split(",")[1];
+"""
+
+class CaptchaSolver:
+    """Solves threat defence challenges in one headless Chrome that is kept warm.
+
+    The browser (and ChromeDriver, resolved once) is started on the first solve and
+    reused for the next ones, it is restarted if it died. Pages are waited on with DOM
+    conditions instead of fixed sleeps, and the CAPTCHA image is OCRed straight from the
+    page instead of from a full screenshot. Solves are serialized: concurrent callers
+    queue on the browser.
+    """
+
+    def __init__(self, timeout=20, driver_path=None):
+        self.timeout = timeout
+        self.driver_path = driver_path
+        self._driver = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
+        if self.driver_path is None:
+            from webdriver_manager.chrome import ChromeDriverManager
+
+            self.driver_path = ChromeDriverManager(path=PROGRAM_HOME).install()
+        options = Options()
+        options.add_argument("--no-sandbox")
+        options.add_argument("--headless")
+        options.add_argument("--log-level=3")
+        options.add_argument("--disable-logging")
+        options.add_argument("--output=" + ("NUL" if sys.platform == "win32" else "/dev/null"))
+        driver = webdriver.Chrome(self.driver_path, options=options,
+                                  service_log_path=("NUL" if sys.platform == "win32" else "/dev/null"))
+        logging.debug("Successfully loaded chrome driver")
+        return driver
+
+    def close(self):
+        if self._driver is not None:
+            try:
+                self._driver.quit()
+            except Exception as e:
+                logging.debug("Error while closing the CAPTCHA browser: %s", e)
+            self._driver = None
+
+    def solve(self, threat_defence_url):
+        """Solve the challenge at `threat_defence_url`, return the browser's cookies"""
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+
+        with self._lock:
+            for attempt in range(2):
+                if self._driver is None:
+                    self._driver = self._start()
+                try:
+                    return self._solve(threat_defence_url)
+                except TimeoutException:
+                    raise
+                except WebDriverException as e:
+                    if attempt:
+                        raise
+                    logging.warning("Restarting the CAPTCHA browser after: %s", e)
+                    self.close()
+
+    def _solve(self, threat_defence_url):
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.common.keys import Keys
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        driver = self._driver
+        wait = WebDriverWait(driver, self.timeout)
+        driver.get(threat_defence_url)
+
+        # the challenge first shows a "Click here" link (after a delay), then the form
+        wait.until(lambda d: d.find_elements(By.ID, "solve_string") or d.find_elements(By.LINK_TEXT, "Click here"))
+        if not driver.find_elements(By.ID, "solve_string"):
+            wait.until(EC.element_to_be_clickable((By.LINK_TEXT, "Click here"))).click()
+        text_field = wait.until(EC.element_to_be_clickable((By.ID, "solve_string")))
+        # the CAPTCHA is the second image of the page
+        image = wait.until(lambda d: next(iter(
+            [img for img in d.find_elements(By.CSS_SELECTOR, "img")[1:2]
+             if d.execute_script("return arguments[0].complete && arguments[0].naturalWidth > 0", img)]
+        ), False))
+
+        solution = self._ocr(self._image_png(image))
+        logging.info("CAPTCHA read as %r", solution)
+        text_field.send_keys(solution)
+        text_field.send_keys(Keys.RETURN)
+        wait.until(EC.staleness_of(text_field))
+        return {c["name"]: c["value"] for c in driver.get_cookies()}
+
+    def _image_png(self, image):
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            return base64.b64decode(self._driver.execute_script(IMAGE_PNG_JS, image))
+        except WebDriverException as e:  # e.g. a cross-origin image taints the canvas
+            logging.debug("Falling back to an element screenshot: %s", e)
+            return image.screenshot_as_png
+
+    def _ocr(self, png):
+        import pytesseract
+        from PIL import Image
+
+        if platform == "win32":
+            pytesseract.pytesseract.tesseract_cmd = os.path.join(PROGRAM_HOME, "Tesseract-OCR", "tesseract")
+        image = Image.open(io.BytesIO(png))
+        try:
+            text = pytesseract.image_to_string(image, config="--psm 7")  # a single line of text
+        except pytesseract.TesseractNotFoundError:
+            logging.warning("Tesseract not found. Attempting to download tesseract ...")
+            download_tesseract(PROGRAM_HOME)
+            text = pytesseract.image_to_string(image, config="--psm 7")
+        return "".join(text.split())
+
+
+_solver = None
+_solver_lock = threading.Lock()
+
+def get_solver():
+    """The process wide CaptchaSolver, its browser is closed at exit"""
+    global _solver
+    with _solver_lock:
+        if _solver is None:
+            _solver = CaptchaSolver()
+            atexit.register(_solver.close)
+        return _solver
+
+def solveCaptcha(threat_defence_url):
+    return get_solver().solve(threat_defence_url)
+
+def deal_with_threat_defence_manual(threat_defence_url):
+    logging.warning(
+        f"""
+    rarbg CAPTCHA must be solved, please follow the instructions bellow (only needs to be done once in a while):
+
+    1. On any PC, open the link in a web browser: "{threat_defence_url}"
+    2. solve and submit the CAPTCHA you should be redirected to a torrent page
+    3. open the console (press F12 -> Console) and paste the following code:
+
+        console.log(document.cookie)
+
+    4. copy the output. it will look something like: "tcc; gaDts48g=q8hppt; gaDts48g=q85p9t; ...."
+    5. paste the output in the terminal here
+
+    >>>
+    """
+    )
+    cookies = input().strip().strip("'").strip('"')
+    cookies = cookies_txt_to_dict(cookies)
+
+    return cookies
+
+def deal_with_threat_defence(threat_defence_url):
+    try:
+        return solveCaptcha(threat_defence_url)
+    except Exception as captcha_exeption:
+        logging.warning("CAPTCHA solver failed")
+        if not sys.stdout.isatty():
+            raise RuntimeWarning (
+                "Failed to solve captcha automatically, please rerun this command (without a pipe `|`) and solve it manually. This process only needs to be done once"
+            ) from captcha_exeption
+
+        print("Failed to solve captcha, please solve manually", captcha_exeption)
+        return deal_with_threat_defence_manual(threat_defence_url)
+
+def lock_file(file):
+    """Block until we hold an exclusive lock on the open `file` (released by closing it)"""
+    if os.name == "nt":
+        import msvcrt
+
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(file, fcntl.LOCK_EX)
+
+class CookieStore:
+    """cookies.json: the threat defence cookies of each domain, shared by concurrent processes.
+
+    Cookies are kept per domain with the time they were acquired. When they stop working
+    (a request gets redirected to threat_defence.php) `expire` records how long they
+    lasted, and `expires_at` predicts the next expiry from those observed lifetimes so
+    the cookies can be renewed ahead of it. Updates are read-modify-writes under an
+    exclusive lock on cookies.json.lock, written through an atomic rename, so parallel
+    CLI invocations don't overwrite each other. The old format (a bare cookie dict)
+    is read as cookies valid for any domain.
+    """
+    MAX_LIFETIMES = 20
+
+    def __init__(self, path=COOKIES_PATH):
+        self.path = path
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="UTF-8") as cookie_json:
+                state = json.load(cookie_json)
+        except FileNotFoundError:
+            state = {}
+        except ValueError as e:
+            logging.warning("Ignoring unreadable cookies file %s: %s", self.path, e)
+            state = {}
+        if state and "domains" not in state:  # a bare cookie dict
+            state = {"domains": {"": {"cookies": state, "acquired": os.path.getmtime(self.path)}}}
+        state.setdefault("domains", {})
+        state.setdefault("lifetimes", {})
+        return state
+
+    @contextlib.contextmanager
+    def _update(self):
+        """Locked read-modify-write: yields the state, saves it afterwards"""
+        import cache_rarbgapi
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a+") as lock:
+            lock_file(lock)
+            state = self._read()
+            yield state
+            cache_rarbgapi.atomic_write(self.path, json.dumps(state, indent=1).encode("utf-8"))
+
+    def _entry(self, state, domain):
+        entry = state["domains"].get(domain) or state["domains"].get("")
+        return entry if entry and not entry.get("expired") else None
+
+    def get(self, domain="", since=None):
+        """The cookies for `domain` ({} if there are none, they stopped working or, with `since`,
+        were acquired before that time)"""
+        entry = self._entry(self._read(), domain)
+        if entry is None or (since is not None and entry["acquired"] < since):
+            return {}
+        return dict(entry["cookies"])
+
+    def put(self, domain, cookies):
+        with self._update() as state:
+            state["domains"][domain] = {"cookies": dict(cookies), "acquired": time.time()}
+
+    def expire(self, domain, cookies):
+        """Record that `cookies` stopped working for `domain` (and how long they lasted)"""
+        with self._update() as state:
+            entry = state["domains"].get(domain)
+            if entry is None or entry.get("expired") or entry["cookies"] != cookies:
+                return
+            entry["expired"] = time.time()
+            lifetimes = state["lifetimes"].setdefault(domain, [])
+            lifetimes.append(entry["expired"] - entry["acquired"])
+            del lifetimes[:-self.MAX_LIFETIMES]
+
+    def _lifetime(self, state, domain):
+        lifetimes = sorted(state["lifetimes"].get(domain, []))
+        return lifetimes[len(lifetimes) // 2] if lifetimes else None
+
+    def lifetime(self, domain):
+        """Median observed lifetime of the cookies of `domain` in seconds, None before the first expiry"""
+        return self._lifetime(self._read(), domain)
+
+    def expires_at(self, domain, margin=1.0):
+        """When `margin` of the expected lifetime of the current cookies of `domain` is over, None if unknown"""
+        state = self._read()
+        entry = self._entry(state, domain)
+        lifetime = self._lifetime(state, domain)
+        if entry is None or lifetime is None:
+            return None
+        return entry["acquired"] + margin * lifetime
+
+    def needs_refresh(self, domain, margin=0.8):
+        """True once `margin` of the expected lifetime of the cookies of `domain` has passed"""
+        expires_at = self.expires_at(domain, margin)
+        return expires_at is not None and time.time() >= expires_at
+
+
+def load_cookies(no_cookie, domain=""):
+    """Function that checks if cookie exists and returns it"""
+    # there are none until a CAPTCHA was solved
+    return {} if no_cookie else CookieStore().get(domain)
+
+class ThreatDefence:
+    """Cookies shared by every worker fetching pages of the same search.
+
+    Only one worker solves a CAPTCHA at a time: while a solve is running the
+    other workers block in `snapshot`/`solve` and then retry with the new
+    cookies instead of starting their own solver sessions.
+    With a `store` (CookieStore) solved cookies are saved, expiries are recorded and
+    cookies another process renewed in the meantime (since this ThreatDefence was
+    created) are picked up instead of solving; cookies stored before that aren't, so
+    starting from {} (--no_cookie) really solves.
+    Solves are recorded in `metrics` (the "captcha" span and "captcha_solves" counter).
+    """
+
+    def __init__(self, cookies, store=None, metrics=None):
+        self.cookies = dict(cookies or {})
+        self.store = store
+        self.metrics = metrics or Metrics()
+        self.generation = 0
+        self.created = time.time()
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def snapshot(self):
+        """Return (generation, cookies) to send with the next request"""
+        with self._lock:
+            return self.generation, dict(self.cookies)
+
+    def _run_solver(self, solver, threat_defence_url):
+        with self.metrics.span("captcha"):
+            cookies = solver(threat_defence_url)
+        self.metrics.count("captcha_solves")
+        return cookies
+
+    def solve(self, threat_defence_url, generation):
+        """Solve the CAPTCHA unless another worker already did since `generation`"""
+        domain = urlsplit(threat_defence_url).netloc
+        with self._lock:
+            if generation != self.generation:
+                logging.debug("Defence already solved by another worker")
+                return self.generation, dict(self.cookies)
+            if self.store is None:
+                self.cookies = self._run_solver(deal_with_threat_defence, threat_defence_url)
+            else:
+                self.store.expire(domain, self.cookies)
+                renewed = self.store.get(domain, since=self.created)
+                if renewed and renewed != self.cookies:
+                    logging.info("Using cookies renewed by another process")
+                    self.cookies = renewed
+                else:
+                    self.cookies = self._run_solver(deal_with_threat_defence, threat_defence_url)
+                    self.store.put(domain, self.cookies)
+            self.generation += 1
+            return self.generation, dict(self.cookies)
+
+    def refresh(self, threat_defence_url):
+        """Renew the cookies before they expire, while requests keep using the current ones.
+
+        Runs the automatic solver only (no manual fallback), failures are logged and ignored.
+        Returns False if a refresh was already running.
+        """
+        domain = urlsplit(threat_defence_url).netloc
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            generation = self.generation
+        try:
+            logging.info("Renewing the cookies of %s ahead of their expiry", domain)
+            cookies = self._run_solver(solveCaptcha, threat_defence_url)
+        except Exception as e:
+            logging.warning("Failed to renew the cookies of %s: %s", domain, e)
+            return True
+        finally:
+            with self._lock:
+                self._refreshing = False
+        with self._lock:
+            if generation == self.generation:
+                self.cookies = cookies
+                self.generation += 1
+            if self.store is not None:
+                self.store.put(domain, cookies)
+        return True
@@ -0,0 +1,577 @@
+"""HTTP clients: AsyncRarbgClient (aiohttp) and its blocking wrapper RarbgClient"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from functools import partial
+from urllib.parse import urlsplit
+
+import cache_rarbgapi
+import ref_rarbgapi as ref
+from captcha_rarbgapi import ThreatDefence
+from metrics_rarbgapi import Metrics
+from scheduler_rarbgapi import PRIORITY_DETAIL, PRIORITY_LISTING, RequestScheduler
+from singleflight_rarbgapi import SingleFlight, normalize_url
+from parse_rarbgapi import LISTING_SCHEMA, Torrent, extract_detail_links, parse_listing, search_url
+
+
+class Page:
+    """A fetched page: what's kept of the HTTP response once its connection is released"""
+    __slots__ = ("status_code", "url", "content", "elapsed")
+
+    def __init__(self, status_code, url, content, elapsed=None):
+        self.status_code = status_code
+        self.url = url
+        self.content = content
+        self.elapsed = elapsed  # seconds from sending the request to the end of the body
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+# statuses that slow the scheduler down and are retried (or failed over from, with mirrors)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+FAILOVER_STATUSES = RETRY_STATUSES
+THREAT_DEFENCE_PATH = "/threat_defence.php?defence=1"
+
+class AsyncRarbgClient:
+    """Non-blocking client (aiohttp) with the whole search pipeline as coroutines.
+
+    Owns a pooled `aiohttp.ClientSession` (keep-alive and TLS session reuse), retries
+    with exponential backoff, timeouts, `ref.DEFAULT_HEADER` and the CAPTCHA cookies.
+    Every request goes through one semaphore of `max_concurrency` slots, so any number
+    of searches can be multiplexed on one event loop without flooding the site.
+    While a CAPTCHA is being solved, new requests wait for the fresh cookies.
+    With a `cache` (cache_rarbgapi.ResultCache) parsed listing pages are served from it,
+    with a `store` (store_rarbgapi.TorrentStore) every fetched torrent is indexed locally.
+    With a `cookie_store` (captcha_rarbgapi.CookieStore) solved cookies are shared with
+    other processes and renewed in the background once `refresh_margin` of their
+    observed lifetime has passed, so searches don't wait on the solve.
+    With `mirrors` (mirrors_rarbgapi.MirrorPool) requests for any of its domains go to
+    the fastest healthy mirror and fail over to the next one on errors.
+    Every request is paced by the `scheduler` (scheduler_rarbgapi.RequestScheduler,
+    a default one with detail pages capped at 4/s if not given), which backs off when
+    the site pushes back.
+    Timings of every stage and request/byte/cache/CAPTCHA counters are recorded in
+    `metrics` (metrics_rarbgapi.Metrics, a new one if not given).
+    With `coalesce` concurrent GETs of the same URL (normalized) share one request, and
+    workers redirected to the same CAPTCHA share one solve, so bursts of identical
+    searches or detail pages don't multiply the requests (and the CAPTCHAs they draw).
+    """
+
+    def __init__(self, cookies=None, pool_size=10, max_concurrency=None, retries=3, backoff=0.5, timeout=30, verify=True,
+                 cache=None, store=None, cookie_store=None, refresh_margin=0.8, mirrors=None, scheduler=None,
+                 metrics=None, coalesce=True):
+        self.cache = cache
+        self.metrics = metrics or Metrics()
+        self.scheduler = scheduler or RequestScheduler(caps={PRIORITY_DETAIL: 4})
+        self.mirrors = mirrors
+        self.store = store
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.verify = verify
+        self.refresh_margin = refresh_margin
+        self.defence = ThreatDefence(cookies, cookie_store, self.metrics)
+        self._refresh = None
+        self._session = None
+        self._semaphore = asyncio.Semaphore(max_concurrency or pool_size)
+        self._solving = asyncio.Lock()
+        self._fetches = SingleFlight(self.metrics, "coalesced_fetches") if coalesce else None
+        self._solves = SingleFlight(self.metrics, "coalesced_solves")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def cookies(self):
+        return self.defence.cookies
+
+    def _get_session(self):
+        if self._session is None:
+            import ssl
+            import aiohttp
+
+            if isinstance(self.verify, str):
+                ssl_context = ssl.create_default_context(cafile=self.verify)
+            else:
+                ssl_context = None if self.verify else False
+            self._session = aiohttp.ClientSession(
+                headers=ref.DEFAULT_HEADER,
+                # pool_size connections to each host (mirror); the request semaphore bounds the total
+                connector=aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_size, ssl=ssl_context),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _request(self, target_url, cookies, retries=None, priority=PRIORITY_LISTING):
+        import aiohttp
+
+        retries = self.retries if retries is None else retries
+        domain = urlsplit(target_url).netloc
+        session = self._get_session()
+        for attempt in range(retries + 1):
+            if attempt:
+                self.metrics.count("retries")
+            with self.metrics.span("wait"):
+                await self.scheduler.acquire(domain, priority)
+            try:
+                async with self._semaphore:
+                    self.metrics.count("requests")
+                    start = time.monotonic()
+                    async with session.get(target_url, cookies=cookies) as response:
+                        content = await response.read()
+                        page = Page(response.status, str(response.url), content, time.monotonic() - start)
+                self.metrics.observe("request", page.elapsed)
+                self.metrics.count("bytes", len(content))
+                if page.status_code not in RETRY_STATUSES:
+                    self.scheduler.success(domain)
+                    return page
+                self.scheduler.backoff(domain)
+                if attempt == retries:
+                    return page
+                logging.warning("Retrying %s after status %s", target_url, page.status_code)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == retries:
+                    raise
+                logging.warning("Retrying %s after %r", target_url, e)
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def _snapshot(self):
+        async with self._solving:
+            return self.defence.snapshot()
+
+    async def _solve(self, threat_defence_url, generation):
+        # every worker redirected since the same cookies awaits the one solve
+        return await self._solves.do((urlsplit(threat_defence_url).netloc, generation),
+                                     self._solve_once, threat_defence_url, generation)
+
+    async def _solve_once(self, threat_defence_url, generation):
+        async with self._solving:
+            # the solver (selenium or input()) blocks, keep it off the event loop
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.defence.solve, threat_defence_url, generation)
+
+    async def get(self, target_url, priority=PRIORITY_LISTING):
+        """GET `target_url`, solving the threat defence CAPTCHA if we get redirected to it.
+
+        URLs of a mirror of the pool are sent to the best mirror instead. A mirror that
+        errors or answers with one of FAILOVER_STATUSES is marked as failing and the
+        request moves on to the next one; only the last mirror gets the retries.
+        Concurrent GETs of the same URL are one request (see `coalesce`).
+        """
+        if self._fetches is None:
+            return await self._route(target_url, priority)
+        return await self._fetches.do(normalize_url(target_url), self._route, target_url, priority)
+
+    async def _route(self, target_url, priority=PRIORITY_LISTING):
+        import aiohttp
+
+        url = urlsplit(target_url)
+        if self.mirrors is None or url.netloc not in self.mirrors:
+            return await self._get(target_url, None, priority)
+        candidates = self.mirrors.candidates()
+        for i, mirror in enumerate(candidates):
+            last = i == len(candidates) - 1
+            try:
+                page = await self._get(url._replace(netloc=mirror).geturl(), None if last else 0, priority)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.mirrors.fail(mirror)
+                if last:
+                    raise
+                logging.warning("Mirror %s failed (%r), trying %s", mirror, e, candidates[i + 1])
+                continue
+            if page.status_code in FAILOVER_STATUSES:
+                self.mirrors.fail(mirror)
+                if not last:
+                    logging.warning("Mirror %s answered %s, trying %s", mirror, page.status_code, candidates[i + 1])
+                    continue
+            else:
+                self.mirrors.record(mirror, page.elapsed)
+            return page
+
+    async def probe_mirrors(self, scheme="https"):
+        """Time a request to the front page of every mirror of the pool (concurrently)"""
+        import aiohttp
+
+        async def probe(mirror):
+            try:
+                page = await self._request(f"{scheme}://{mirror}/", {}, retries=0)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.info("Mirror %s is down: %r", mirror, e)
+                self.mirrors.fail(mirror)
+                return
+            if page.status_code in FAILOVER_STATUSES:
+                logging.info("Mirror %s is down: status %s", mirror, page.status_code)
+                self.mirrors.fail(mirror)
+            else:
+                self.mirrors.record(mirror, page.elapsed)
+
+        await asyncio.gather(*map(probe, self.mirrors.domains))
+        self.mirrors.probed()
+        logging.info("Mirrors: %s", ", ".join(
+            f"{mirror} {'-' if latency is None else f'{latency * 1000:.0f}ms'}{'' if healthy else ' (down)'}"
+            for mirror, (latency, healthy) in self.mirrors.stats().items()))
+
+    async def _get(self, target_url, retries=None, priority=PRIORITY_LISTING):
+        generation, cookies = await self._snapshot()
+        while True:
+            page = await self._request(target_url, cookies, retries, priority)
+            logging.info("Opening page: %s", page.url)
+            if "threat_defence.php" not in page.url:
+                logging.debug("Defence not detected")
+                return page
+            logging.info("Defence detected")
+            self.scheduler.backoff(urlsplit(target_url).netloc)
+            generation, cookies = await self._solve(page.url, generation)
+
+    async def refresh_cookies(self, target_url, force=False):
+        """Start renewing the cookies for the site of `target_url` if they are about to expire.
+
+        The solve runs in the background and requests keep using the current cookies
+        meanwhile. Returns the future of the refresh, or None if none was needed.
+        """
+        if self.defence.store is None:
+            return None
+        url = urlsplit(target_url)
+        if not force and not self.defence.store.needs_refresh(url.netloc, self.refresh_margin):
+            return None
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.get_running_loop().run_in_executor(
+                None, self.defence.refresh, f"{url.scheme}://{url.netloc}{THREAT_DEFENCE_PATH}")
+        return self._refresh
+
+    async def get_page_html(self, target_url, priority=PRIORITY_LISTING):
+        with self.metrics.span("page"):
+            page = await self.get(target_url, priority)
+        return page, page.content
+
+    async def fetch_pages(self, page_url, concurrency=1, start=1):
+        """Async version of fetch_pages"""
+        pages = ((page_num, page_url(page_num)) for page_num in itertools.count(start))
+        pending = deque()
+
+        def submit(count):
+            for page_num, target_url in itertools.islice(pages, count):
+                pending.append((page_num, asyncio.ensure_future(self.get_page_html(target_url))))
+
+        try:
+            submit(concurrency)
+            while pending:
+                page_num, task = pending[0]
+                page, html = await task
+                pending.popleft()
+                yield page_num, page, html
+                submit(1)
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def iter_torrent_pages(self,
+        search,
+        category="",
+        domain="rarbgunblocked.org",
+        order="",
+        descending=False,
+        concurrency=4,
+        parser="auto",
+        on_page=None,
+        refresh=False,
+    ):
+        """Async version of iter_torrent_pages"""
+        page_url = partial(search_url, search, category, domain, order, descending)
+        cache_key = partial(cache_rarbgapi.query_key, search, category, order, descending,
+                            domain=domain.strip(), schema=LISTING_SCHEMA)
+        first_page = 1
+        if self.cache is not None and not refresh:
+            for first_page in itertools.count(1):
+                with self.metrics.span("cache_read"):
+                    records = self.cache.get(cache_key(first_page))
+                if records is None:
+                    self.metrics.count("cache_misses")
+                    break
+                self.metrics.count("cache_hits")
+                logging.info("%s torrents found in cache", len(records))
+                if not records:
+                    return
+                yield first_page, [Torrent.from_record(record) for record in records]
+
+        if self.mirrors is not None and domain.strip() in self.mirrors and self.mirrors.needs_probe():
+            await self.probe_mirrors(urlsplit(page_url(first_page)).scheme)
+        await self.refresh_cookies(page_url(first_page))
+        pages = self.fetch_pages(page_url, concurrency, first_page)
+        try:
+            async for page_num, response, html in pages:  # for all pages
+                if on_page is not None:
+                    on_page(page_num, response)
+
+                if response.status_code != 200:
+                    logging.error("Status %s when accessing %s", response.status_code, page_url(page_num))
+                    return
+
+                # records link to the mirror that served them
+                torrents = await asyncio.to_thread(self._parse, html, urlsplit(response.url).netloc, parser)
+                logging.info("%s torrents found", len(torrents))
+                self.metrics.count("torrents", len(torrents))
+                if self.cache is not None:
+                    with self.metrics.span("cache_write"):
+                        self.cache.put(cache_key(page_num), [t.to_record() for t in torrents])
+                if self.store is not None:
+                    with self.metrics.span("index_write"):
+                        await asyncio.to_thread(self.store.upsert, torrents)
+                if not torrents:
+                    return
+                yield page_num, torrents
+        finally:
+            await pages.aclose()
+
+    def _parse(self, html, domain, parser):
+        with self.metrics.span("parse"):
+            return parse_listing(html, domain, parser)
+
+    async def iter_torrents(self, search, limit=float("inf"), where=None, resolve=False, workers=4, **kwargs):
+        """Async version of iter_torrents"""
+        if limit <= 0:
+            return
+        seen = set()
+        emitted = 0
+        pages = self.iter_torrent_pages(search, **kwargs)
+        try:
+            async for _, torrents in pages:
+                matches = []
+                for torrent in torrents:
+                    if torrent in seen:
+                        continue
+                    seen.add(torrent)
+                    if where is not None and not where(torrent):
+                        continue
+                    matches.append(torrent)
+                    if emitted + len(matches) >= limit:
+                        break
+                if resolve:
+                    await self.resolve_magnets(matches, workers)
+                for torrent in matches:
+                    yield torrent
+                emitted += len(matches)
+                if emitted >= limit:
+                    logging.info("Stopping: Reached limit %s", limit)
+                    return
+                if where is not None and where.exhausted(torrents, kwargs.get("order", ""), kwargs.get("descending", False)):
+                    logging.info("Stopping: no later page can match %r", where)
+                    return
+        finally:
+            await pages.aclose()
+
+    async def iter_new_torrents(self, search, watch, limit=float("inf"), where=None, resolve=False, workers=4, **kwargs):
+        """Async version of iter_new_torrents"""
+        if limit <= 0:
+            return
+        kwargs["refresh"] = True
+        emitted = 0
+        pages = self.iter_torrent_pages(search, **kwargs)
+        try:
+            async for _, torrents in pages:
+                seen_on_page = False
+                matches = []
+                for torrent in torrents:
+                    if torrent.key in watch:
+                        seen_on_page = True
+                        continue
+                    if where is not None and not where(torrent):
+                        continue
+                    matches.append(torrent)
+                    if emitted + len(matches) >= limit:
+                        break
+                if resolve:
+                    await self.resolve_magnets(matches, workers)
+                for torrent in matches:
+                    # seen once handed to the consumer: stopping early leaves the rest for the next run
+                    watch.add(torrent.key)
+                    emitted += 1
+                    yield torrent
+                if emitted >= limit:
+                    logging.info("Stopping: Reached limit %s", limit)
+                    return
+                if not matches and (seen_on_page or where is None):
+                    logging.info("Stopping: no new torrents on this page")
+                    return
+                if where is not None and where.exhausted(torrents, kwargs.get("order", ""), kwargs.get("descending", False)):
+                    logging.info("Stopping: no later page can match %r", where)
+                    return
+        finally:
+            await pages.aclose()
+            watch.save()
+
+    async def search(self, search, limit=float("inf"), resolve=True, workers=4, **kwargs):
+        """Return the list of Torrent records for `search`, with missing magnets resolved"""
+        torrents = [t async for t in self.iter_torrents(search, limit, **kwargs)]
+        if resolve:
+            await self.resolve_magnets(torrents, workers)
+        return torrents
+
+    async def search_batch(self, queries, max_queries=4, **kwargs):
+        """Async generator of (query, torrents, error) for every query, as each one finishes.
+
+        Queries are dicts of "search" and optionally the other arguments of `search`,
+        which override `kwargs`. At most `max_queries` run at once, all sharing this
+        client's connections, cache, cookies and scheduler. A failing query is yielded
+        with its exception as `error` (and torrents None), the others carry on.
+        """
+        semaphore = asyncio.Semaphore(max_queries)
+
+        async def run(query):
+            async with semaphore:
+                options = dict(kwargs, **query)
+                try:
+                    return query, await self.search(options.pop("search"), **options), None
+                except Exception as e:
+                    logging.warning("Query %s failed: %r", query, e)
+                    return query, None, e
+
+        tasks = [asyncio.ensure_future(run(query)) for query in queries]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def resolve_magnets(self, torrents, workers=4):
+        """Async version of resolve_magnets"""
+        semaphore = asyncio.Semaphore(workers)
+
+        async def resolve(torrent):
+            async with semaphore:
+                logging.info("fetching magnet link for %s", torrent.title)
+                with self.metrics.span("detail"):
+                    _, html_subpage = await self.get_page_html(torrent.href, PRIORITY_DETAIL)
+                    return extract_detail_links(html_subpage)
+
+        todo = [t for t in torrents if not t.magnet]
+        failures = []
+        results = await asyncio.gather(*map(resolve, todo), return_exceptions=True)
+        for torrent, result in zip(todo, results):
+            if isinstance(result, BaseException):
+                logging.warning("Failed to fetch magnet link for %s: %s", torrent.title, result)
+                failures.append((torrent, result))
+                continue
+            torrent.resolved_magnet, _ = result
+        return failures
+
+    async def download(self, torrents, sink, workers=4):
+        """Send `torrents` to `sink` (see download_rarbgapi), return a DownloadReport"""
+        import download_rarbgapi
+
+        return await download_rarbgapi.download(self, torrents, sink, workers)
+
+
+class RarbgClient:
+    """Blocking wrapper around AsyncRarbgClient.
+
+    Runs the async client on a private event loop in a background thread, so it can be
+    used (also from several threads at once) by plain synchronous code.
+    Generators it returns that are still open when it's closed are closed first, while
+    the loop still runs their cleanup.
+    """
+
+    def __init__(self, cookies=None, **kwargs):
+        self.aclient = AsyncRarbgClient(cookies, **kwargs)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="rarbgapi-loop", daemon=True)
+        self._thread.start()
+        self._iterators = weakref.WeakSet()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        for iterator in list(self._iterators):
+            try:
+                iterator.close()
+            except ValueError:  # running in another thread, it stops with the loop
+                pass
+        self._run(self.aclient.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    @property
+    def defence(self):
+        return self.aclient.defence
+
+    @property
+    def cookies(self):
+        return self.aclient.cookies
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _iterate(self, agen):
+        iterator = self._drive(agen)
+        self._iterators.add(iterator)
+        return iterator
+
+    def _drive(self, agen):
+        try:
+            while True:
+                try:
+                    item = self._run(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+                yield item
+        finally:
+            self._run(agen.aclose())
+
+    def get(self, target_url, priority=PRIORITY_LISTING):
+        return self._run(self.aclient.get(target_url, priority))
+
+    def get_page_html(self, target_url, priority=PRIORITY_LISTING):
+        return self._run(self.aclient.get_page_html(target_url, priority))
+
+    def probe_mirrors(self, scheme="https"):
+        return self._run(self.aclient.probe_mirrors(scheme))
+
+    def refresh_cookies(self, target_url, force=False):
+        """Start a background cookie refresh if needed (see AsyncRarbgClient), return whether one runs"""
+        return self._run(self.aclient.refresh_cookies(target_url, force)) is not None
+
+    def fetch_pages(self, page_url, concurrency=1, start=1):
+        return self._iterate(self.aclient.fetch_pages(page_url, concurrency, start))
+
+    def iter_torrent_pages(self, search, **kwargs):
+        return self._iterate(self.aclient.iter_torrent_pages(search, **kwargs))
+
+    def iter_torrents(self, search, limit=float("inf"), **kwargs):
+        return self._iterate(self.aclient.iter_torrents(search, limit, **kwargs))
+
+    def iter_new_torrents(self, search, watch, limit=float("inf"), **kwargs):
+        return self._iterate(self.aclient.iter_new_torrents(search, watch, limit, **kwargs))
+
+    def search(self, search, limit=float("inf"), **kwargs):
+        return self._run(self.aclient.search(search, limit, **kwargs))
+
+    def search_batch(self, queries, max_queries=4, **kwargs):
+        return self._iterate(self.aclient.search_batch(queries, max_queries, **kwargs))
+
+    def download(self, torrents, sink, workers=4):
+        return self._run(self.aclient.download(torrents, sink, workers))
+
+    def resolve_magnets(self, torrents, workers=4):
+        return self._run(self.aclient.resolve_magnets(torrents, workers))
@@ -0,0 +1,220 @@
+"""Download pipeline: .torrent files to a directory or magnets to a torrent client's RPC, in parallel"""
+import asyncio
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import webbrowser
+from urllib.parse import urlsplit
+
+from cache_rarbgapi import atomic_write
+from scheduler_rarbgapi import PRIORITY_DETAIL
+
+UNSAFE_FILENAME_RE = re.compile(r"[^\w.\-\[\]() ]+")
+
+
+class DownloadReport:
+    """What a download run did: `sent` and `skipped` (duplicates) torrents, `failed` (torrent, error) pairs"""
+
+    def __init__(self):
+        self.sent = []
+        self.failed = []
+        self.skipped = []
+
+    def __bool__(self):
+        return not self.failed
+
+    def to_dict(self):
+        return {
+            "sent": [t.title for t in self.sent],
+            "failed": [{"title": t.title, "error": str(error)} for t, error in self.failed],
+            "skipped": [t.title for t in self.skipped],
+        }
+
+    def __str__(self):
+        lines = [f"{len(self.sent)} sent, {len(self.failed)} failed, {len(self.skipped)} duplicates skipped"]
+        lines += [f"  failed: {t.title}: {error}" for t, error in self.failed]
+        return "\n".join(lines)
+
+
+class TorrentFileSink:
+    """Saves the .torrent files into `directory`, fetched over the client's pooled session and cookies"""
+
+    needs_magnet = False  # the .torrent URL comes from the listing
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, torrent):
+        """`<name> [<info-hash or detail page id>].torrent`: torrents with the same name don't overwrite each other"""
+        key = UNSAFE_FILENAME_RE.sub("_", torrent.key.strip("/").rsplit("/", 1)[-1])
+        name = UNSAFE_FILENAME_RE.sub("_", torrent.name or torrent.title).strip(" .")
+        return os.path.join(self.directory, f"{name} [{key}].torrent" if name else f"{key}.torrent")
+
+    async def send(self, client, torrents, workers=4):
+        os.makedirs(self.directory, exist_ok=True)
+        semaphore = asyncio.Semaphore(workers)
+
+        async def fetch(torrent):
+            async with semaphore:
+                page, content = await client.get_page_html(torrent.torrent, PRIORITY_DETAIL)
+            if page.status_code != 200 or not content.startswith(b"d"):  # bencoded dictionary
+                raise ValueError(f"not a torrent file (status {page.status_code}, {len(content)} bytes)")
+            await asyncio.to_thread(atomic_write, self.path(torrent), content)
+
+        return await asyncio.gather(*map(fetch, torrents), return_exceptions=True)
+
+
+class RpcSink:
+    """Base of the torrent client sinks: an aiohttp session of their own, HTTP basic auth from the URL"""
+
+    needs_magnet = True
+
+    def __init__(self, url, timeout=30):
+        url = urlsplit(url)
+        self.url = url._replace(netloc=url.hostname + (f":{url.port}" if url.port else "")).geturl()
+        self.auth = (url.username, url.password or "") if url.username else None
+        self.timeout = timeout
+
+    def _session(self):
+        import aiohttp
+
+        auth = aiohttp.BasicAuth(*self.auth) if self.auth else None
+        return aiohttp.ClientSession(auth=auth, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+
+class TransmissionSink(RpcSink):
+    """Adds magnets through Transmission's RPC (http://host:9091/transmission/rpc), `workers` calls at a time
+    over one keep-alive connection pool"""
+
+    async def send(self, client, torrents, workers=4):
+        semaphore = asyncio.Semaphore(workers)
+        session_id = None
+
+        async def add(session, torrent):
+            nonlocal session_id
+            request = {"method": "torrent-add", "arguments": {"filename": torrent.magnet}}
+            async with semaphore:
+                for _ in range(2):  # a 409 comes with a new session id to retry with
+                    headers = {"X-Transmission-Session-Id": session_id} if session_id else {}
+                    async with session.post(self.url, json=request, headers=headers) as response:
+                        if response.status == 409:
+                            session_id = response.headers.get("X-Transmission-Session-Id")
+                            continue
+                        response.raise_for_status()
+                        result = (await response.json(content_type=None)).get("result")
+                    if result != "success":
+                        raise RuntimeError(f"transmission: {result}")
+                    return
+                raise RuntimeError("transmission: no session id")
+
+        async with self._session() as session:
+            # get the session id once, instead of a 409 for each of the first parallel calls
+            try:
+                async with session.post(self.url, json={"method": "session-get"}) as response:
+                    session_id = response.headers.get("X-Transmission-Session-Id")
+            except Exception as e:
+                return [e] * len(torrents)
+            return await asyncio.gather(*(add(session, t) for t in torrents), return_exceptions=True)
+
+
+class QBittorrentSink(RpcSink):
+    """Adds every magnet in one call of qBittorrent's Web API (http://host:8080)"""
+
+    async def send(self, client, torrents, workers=4):
+        import aiohttp
+
+        base = self.url.rstrip("/")
+        async with self._session() as session:
+            try:
+                if self.auth:
+                    username, password = self.auth
+                    async with session.post(f"{base}/api/v2/auth/login",
+                                            data={"username": username, "password": password}) as response:
+                        if response.status != 200 or (await response.text()).strip() != "Ok.":
+                            raise RuntimeError(f"qbittorrent login failed (status {response.status})")
+                form = aiohttp.FormData({"urls": "\n".join(t.magnet for t in torrents)})
+                async with session.post(f"{base}/api/v2/torrents/add", data=form) as response:
+                    response.raise_for_status()
+            except Exception as e:
+                return [e] * len(torrents)
+        return [None] * len(torrents)
+
+
+class BrowserSink:
+    """Opens the magnets with the default handler (the desktop fallback: nothing to do on a headless server).
+
+    The whole batch goes to one handler invocation where the platform's opener takes several
+    URLs (`open` on macOS, `gio open` elsewhere), else to the browser one magnet at a time.
+    """
+
+    needs_magnet = True
+
+    @staticmethod
+    def command():
+        if sys.platform == "darwin":
+            return ["open"]
+        if os.name == "posix" and shutil.which("gio"):
+            return ["gio", "open"]
+        return None
+
+    async def send(self, client, torrents, workers=4):
+        magnets = [t.magnet for t in torrents]
+        command = self.command()
+        if command is not None:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *command, *magnets, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                _, stderr = await process.communicate()
+            except OSError as e:
+                return [e] * len(torrents)
+            if process.returncode:
+                error = RuntimeError(f"{command[0]}: {stderr.decode(errors='replace').strip() or process.returncode}")
+                return [error] * len(torrents)
+            return [None] * len(torrents)
+        opened = await asyncio.to_thread(lambda: [webbrowser.open(magnet) for magnet in magnets])
+        return [None if ok else RuntimeError("no browser to open it with") for ok in opened]
+
+
+RPC_SINKS = {"transmission": TransmissionSink, "qbittorrent": QBittorrentSink}
+
+
+def get_sink(download_dir=None, rpc=None, rpc_type="transmission"):
+    """The sink for the command line options: --rpc, else --download_dir, else the browser"""
+    if rpc:
+        return RPC_SINKS[rpc_type](rpc)
+    if download_dir:
+        return TorrentFileSink(download_dir)
+    return BrowserSink()
+
+
+async def download(client, torrents, sink, workers=4):
+    """Send `torrents` (duplicates by Torrent.key, the info-hash or detail page, dropped) to `sink`,
+    return a DownloadReport.
+
+    `client` is an AsyncRarbgClient. For sinks that take magnets (`sink.needs_magnet`) missing
+    magnets are resolved with it first, paced by its scheduler's cap on detail pages (--detail_rate).
+    """
+    report = DownloadReport()
+    unresolved = set()
+    if getattr(sink, "needs_magnet", True):
+        unresolved = {id(t) for t, _ in await client.resolve_magnets(torrents, workers)}
+    unique = {}
+    for torrent in torrents:
+        if id(torrent) in unresolved:
+            report.failed.append((torrent, RuntimeError("magnet link not found")))
+            continue
+        if torrent.key in unique:
+            report.skipped.append(torrent)
+        else:
+            unique[torrent.key] = torrent
+    results = await sink.send(client, list(unique.values()), workers) if unique else []
+    for torrent, result in zip(unique.values(), results):
+        if isinstance(result, BaseException):
+            logging.warning("Couldn't download %s: %s", torrent.title, result)
+            report.failed.append((torrent, result))
+        else:
+            report.sent.append(torrent)
+    return report
@@ -0,0 +1,140 @@
+"""Columnar export of results: Parquet or Arrow IPC (with pyarrow), CSV otherwise, written in batches"""
+import csv
+import logging
+import os
+
+# the export schema: column, Arrow type, value of a Torrent record
+EXPORT_COLUMNS = [
+    ("title", "string", lambda t: t.title),
+    ("info_hash", "string", lambda t: t.info_hash or None),
+    ("category_code", "int16", lambda t: int(t.category_code) if str(t.category_code or "").isdigit() else None),
+    ("size", "int64", lambda t: t.size),  # bytes
+    ("date", "timestamp", lambda t: int(t.date)),  # seconds since the epoch, UTC
+    ("seeders", "int32", lambda t: t.seeders),
+    ("leechers", "int32", lambda t: t.leechers),
+    ("uploader", "string", lambda t: t.uploader),
+    ("href", "string", lambda t: t.href),
+    ("magnet", "string", lambda t: t.magnet or None),
+]
+EXPORT_FORMATS = {".parquet": "parquet", ".arrow": "arrow", ".ipc": "arrow", ".feather": "arrow", ".csv": "csv"}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def arrow_schema():
+    pa = _pyarrow()
+    types = {"string": pa.string(), "int16": pa.int16(), "int32": pa.int32(), "int64": pa.int64(),
+             "timestamp": pa.timestamp("s", tz="UTC")}
+    return pa.schema([(name, types[kind]) for name, kind, _ in EXPORT_COLUMNS])
+
+
+def columns(torrents):
+    """The export columns of a batch of Torrent records: {name: list of values}"""
+    return {name: [value(t) for t in torrents] for name, _, value in EXPORT_COLUMNS}
+
+
+class CsvExporter:
+    """Rows of the export schema as CSV (sizes in bytes, dates as epoch seconds, empty for missing)"""
+
+    format = "csv"
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(name for name, _, _ in EXPORT_COLUMNS)
+
+    def write_batch(self, torrents):
+        self._writer.writerows(zip(*columns(torrents).values()))
+
+    def close(self):
+        self._file.close()
+
+
+class ArrowExporter:
+    """Record batches of the export schema into an Arrow IPC file (`export_format="arrow"`) or,
+    one row group per batch, a Parquet file (`export_format="parquet"`)"""
+
+    def __init__(self, path, export_format="parquet"):
+        pa = _pyarrow()
+        self.path = path
+        self.format = export_format
+        self.schema = arrow_schema()
+        if export_format == "parquet":
+            import pyarrow.parquet
+
+            self._writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema)
+
+    def write_batch(self, torrents):
+        pa = _pyarrow()
+        batch = pa.RecordBatch.from_pydict(columns(torrents), schema=self.schema)
+        if self.format == "parquet":
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write(batch)
+
+    def close(self):
+        self._writer.close()
+
+
+class Exporter:
+    """Writes Torrent records to `path` in batches of `batch_size`, holding at most one batch in memory.
+
+    The format is `export_format` or else the extension of `path` (.parquet, .arrow/.ipc/.feather,
+    .csv). Without pyarrow Parquet and Arrow fall back to CSV, next to `path` with a .csv
+    extension. `on_batch` is called with every batch before it's written (e.g. to resolve
+    the missing magnets of the batch at once).
+    """
+
+    def __init__(self, path, export_format=None, batch_size=10000, on_batch=None):
+        export_format = export_format or EXPORT_FORMATS.get(os.path.splitext(path)[1].lower(), "csv")
+        if export_format != "csv" and _pyarrow() is None:
+            path = os.path.splitext(path)[0] + ".csv"
+            logging.warning("pyarrow isn't installed (pip install pyarrow for %s), exporting CSV to %s",
+                            export_format, path)
+            export_format = "csv"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.sink = CsvExporter(path) if export_format == "csv" else ArrowExporter(path, export_format)
+        self.path = path
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.rows = 0
+        self._batch = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, torrent):
+        self._batch.append(torrent)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def write_all(self, torrents):
+        for torrent in torrents:
+            self.write(torrent)
+
+    def flush(self):
+        if not self._batch:
+            return
+        if self.on_batch is not None:
+            self.on_batch(self._batch)
+        self.sink.write_batch(self._batch)
+        self.rows += len(self._batch)
+        self._batch = []
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.sink.close()
@@ -0,0 +1,91 @@
+"""Numeric result filters (size, seeders, upload date, uploader), applied while results stream in"""
+import datetime
+import re
+
+import ref_rarbgapi as ref
+
+SIZE_RE = re.compile(r"^\s*([0-9]*\.?[0-9]+)\s*([A-Za-z]*)\s*$")
+
+
+def parse_size_arg(text):
+    """Bytes of a size given on the command line: "1.5GB", "700 MB", "4G" or a plain byte count"""
+    match = SIZE_RE.match(text)
+    if not match:
+        raise ValueError(f"invalid size {text!r}")
+    number, unit = match.groups()
+    unit = unit.upper()
+    if not unit:
+        return int(float(number))
+    if unit in ("K", "M", "G", "T"):
+        unit += "B"
+    if unit not in ref.SIZE_UNITS:
+        raise ValueError(f"unknown size unit {unit!r} (use one of {', '.join(ref.SIZE_UNITS)})")
+    return int(float(number) * ref.SIZE_UNITS[unit])
+
+
+def parse_date_arg(text):
+    """Timestamp of a date (or date and time) given on the command line, like 2020-01-31 or 2020-01-31T12:00"""
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+# listing order: (Torrent attribute, bound that a descending order runs below, bound an ascending order runs above)
+ORDERED_BOUNDS = {
+    "seeders": ("seeders", "min_seeders", None),
+    "size": ("size", "min_size", "max_size"),
+    "data": ("date", "since", "until"),
+}
+
+
+class TorrentFilter:
+    """Which Torrent records to keep, on numeric fields (sizes in bytes, dates as timestamps).
+
+    Calling it with a Torrent tells whether it matches. Takes the same keywords as
+    store_rarbgapi.TorrentStore.search, so one set of filters works online and offline.
+    """
+
+    __slots__ = ("min_size", "max_size", "min_seeders", "uploader", "since", "until")
+
+    def __init__(self, min_size=None, max_size=None, min_seeders=None, uploader=None, since=None, until=None):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_seeders = min_seeders
+        self.uploader = uploader
+        self.since = since
+        self.until = until
+
+    def __bool__(self):
+        return any(getattr(self, name) is not None for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__
+                           if getattr(self, name) is not None)
+        return f"TorrentFilter({fields})"
+
+    def as_kwargs(self):
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    def __call__(self, torrent):
+        return not (
+            self.min_size is not None and torrent.size < self.min_size
+            or self.max_size is not None and torrent.size > self.max_size
+            or self.min_seeders is not None and torrent.seeders < self.min_seeders
+            or self.since is not None and torrent.date < self.since
+            or self.until is not None and torrent.date > self.until
+            or self.uploader is not None and torrent.uploader != self.uploader
+        )
+
+    def exhausted(self, page, order="", descending=False):
+        """True when no page after `page` can match, because the listing is ordered by a filtered field.
+
+        E.g. with order="seeders", descending=True and min_seeders=10, a page ending
+        below 10 seeders means every later page is below 10 seeders too.
+        """
+        if not page or order not in ORDERED_BOUNDS:
+            return False
+        attribute, descending_bound, ascending_bound = ORDERED_BOUNDS[order]
+        bound = descending_bound if descending else ascending_bound
+        limit = bound and getattr(self, bound)
+        if limit is None:
+            return False
+        last = getattr(page[-1], attribute)
+        return last < limit if descending else last > limit
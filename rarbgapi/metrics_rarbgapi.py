@@ -0,0 +1,127 @@
+"""Instrumentation: timing spans and counters of the stages of a search, with exporters"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# what the client records, for reference
+SPANS = {
+    "page": "get_page_html: fetching one page, retries and threat defence included",
+    "request": "one HTTP request (a single attempt)",
+    "wait": "waiting for the request scheduler to let a request through",
+    "parse": "parsing a listing page",
+    "captcha": "solving the threat defence CAPTCHA",
+    "detail": "fetching a detail page and extracting its links",
+    "cache_read": "reading a listing page from the result cache",
+    "cache_write": "writing a listing page to the result cache",
+    "index_write": "upserting a page of torrents into the local index",
+}
+COUNTERS = {
+    "requests": "HTTP requests sent",
+    "bytes": "bytes of response bodies received",
+    "retries": "requests retried after an error or a 429/5xx",
+    "cache_hits": "listing pages served from the result cache",
+    "cache_misses": "listing pages not in the result cache",
+    "captcha_solves": "CAPTCHAs solved (automatically or by hand)",
+    "torrents": "torrents parsed from listing pages",
+    "queries": "searches asked of the server (rarbgapi serve)",
+    "coalesced": "server searches answered by an identical one already in flight",
+    "coalesced_fetches": "GETs answered by a request of the same URL already in flight",
+    "coalesced_solves": "CAPTCHA redirects answered by a solve already in flight",
+}
+
+
+class Metrics:
+    """Timing spans and counters, thread-safe and cheap enough to always be on.
+
+    `span(name)` times a block, `observe` records a duration measured elsewhere and
+    `count` adds to a counter. Every span keeps its count, total and max seconds
+    (failed blocks are timed too, cancelled ones aren't).
+    Concurrent spans overlap, so their totals can add up to more than the wall time.
+    Listeners added with `subscribe` are called with ("span", name, seconds) or
+    ("counter", name, increment) for every observation, e.g. to forward them to a
+    metrics backend; they run on the thread that recorded the observation.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._spans = {}  # name: [count, total seconds, max seconds]
+        self._counters = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+        return listener
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        # cancelled blocks (prefetches dropped at the end of a search) aren't recorded
+        try:
+            yield
+        except Exception:
+            self.observe(name, time.perf_counter() - start)
+            raise
+        else:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                self._spans[name] = [1, seconds, seconds]
+            else:
+                span[0] += 1
+                span[1] += seconds
+                span[2] = max(span[2], seconds)
+        for listener in self._listeners:
+            listener("span", name, seconds)
+
+    def count(self, name, increment=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + increment
+        for listener in self._listeners:
+            listener("counter", name, increment)
+
+    def summary(self):
+        """{"wall_seconds": ..., "spans": {name: {"count", "total", "max"}}, "counters": {name: value}}"""
+        with self._lock:
+            return {
+                "wall_seconds": time.perf_counter() - self.started,
+                "spans": {name: {"count": count, "total": total, "max": longest}
+                          for name, (count, total, longest) in sorted(self._spans.items())},
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+    def to_prometheus(self, prefix="rarbgapi"):
+        """The metrics in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines = [
+            f"# HELP {prefix}_span_seconds Time spent per stage",
+            f"# TYPE {prefix}_span_seconds summary",
+        ]
+        for name, span in summary["spans"].items():
+            lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {span["count"]}')
+            lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {span["total"]:.6f}')
+        for name, value in summary["counters"].items():
+            lines.append(f"# HELP {prefix}_{name}_total {COUNTERS.get(name, name)}")
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def format_table(self):
+        """Human readable breakdown, as printed by --stats"""
+        summary = self.summary()
+        lines = [f"{'stage':>12} {'count':>7} {'total s':>9} {'mean ms':>9} {'max ms':>9}"]
+        for name, span in sorted(summary["spans"].items(), key=lambda item: -item[1]["total"]):
+            lines.append(f"{name:>12} {span['count']:>7} {span['total']:>9.3f} "
+                         f"{span['total'] / span['count'] * 1000:>9.1f} {span['max'] * 1000:>9.1f}")
+        lines.append("")
+        for name, value in summary["counters"].items():
+            lines.append(f"{name:>14} {value:>10}")
+        lines.append(f"{'wall seconds':>14} {summary['wall_seconds']:>10.3f}")
+        return "\n".join(lines)
@@ -0,0 +1,72 @@
+"""Pool of mirror domains: the fastest healthy one gets the requests, failing ones are skipped"""
+import threading
+import time
+
+
+class MirrorPool:
+    """Mirrors of the site ranked by an EWMA of their response latency.
+
+    `candidates()` lists the healthy mirrors fastest first (mirrors without a latency
+    sample yet first, in the given order, so each gets tried), then the mirrors that are
+    down, the ones that come back soonest first. `fail` takes a mirror down for
+    `cooldown` seconds, doubling for every consecutive failure up to `max_cooldown`.
+    Thread-safe.
+    """
+
+    def __init__(self, domains, alpha=0.3, cooldown=30, max_cooldown=600, probe_interval=300):
+        self.domains = list(dict.fromkeys(domain.strip() for domain in domains))
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_interval = probe_interval
+        self.latency = dict.fromkeys(self.domains)  # seconds (EWMA), None before the first sample
+        self._failures = dict.fromkeys(self.domains, 0)
+        self._down_until = dict.fromkeys(self.domains, 0.0)
+        self._probed = 0.0
+        self._lock = threading.Lock()
+
+    def __contains__(self, domain):
+        return domain in self.latency
+
+    def __len__(self):
+        return len(self.domains)
+
+    def record(self, domain, latency):
+        """A successful response from `domain` that took `latency` seconds"""
+        with self._lock:
+            previous = self.latency[domain]
+            self.latency[domain] = latency if previous is None else self.alpha * latency + (1 - self.alpha) * previous
+            self._failures[domain] = 0
+            self._down_until[domain] = 0.0
+
+    def fail(self, domain):
+        with self._lock:
+            self._failures[domain] += 1
+            cooldown = min(self.cooldown * 2 ** (self._failures[domain] - 1), self.max_cooldown)
+            self._down_until[domain] = time.monotonic() + cooldown
+
+    def healthy(self, domain):
+        return self._down_until[domain] <= time.monotonic()
+
+    def candidates(self):
+        """Every mirror in the order to try them"""
+        with self._lock:
+            now = time.monotonic()
+            up = [domain for domain in self.domains if self._down_until[domain] <= now]
+            down = [domain for domain in self.domains if self._down_until[domain] > now]
+            up.sort(key=lambda domain: self.latency[domain] or 0.0)
+            down.sort(key=self._down_until.get)
+            return up + down
+
+    def best(self):
+        return self.candidates()[0]
+
+    def needs_probe(self):
+        return time.monotonic() - self._probed >= self.probe_interval
+
+    def probed(self):
+        self._probed = time.monotonic()
+
+    def stats(self):
+        """{domain: (latency, healthy)} for logging"""
+        return {domain: (self.latency[domain], self.healthy(domain)) for domain in self.domains}
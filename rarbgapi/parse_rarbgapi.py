@@ -0,0 +1,316 @@
+"""Listing and detail page parsing, and the Torrent record search results are made of
+
+Only needs the standard library on import; the HTML parser backend is imported on first parse.
+"""
+import bisect
+import datetime
+import html as htmllib
+import re
+from urllib.parse import quote
+
+import ref_rarbgapi as ref
+
+
+def parse_size(size: str):
+    """Bytes of a listing size cell, like 1.37 GB"""
+    return parse_sizes([size])[0]
+
+
+def parse_sizes(sizes):
+    """Bytes of a column of size cells (one page): every cell is split once and the
+    factor of each distinct unit string looked up once"""
+    factors = {}
+    parsed = []
+    for size in sizes:
+        number, _, unit = size.strip().partition(" ")
+        factor = factors.get(unit)
+        if factor is None:
+            factor = factors[unit] = ref.SIZE_UNITS[unit.strip()]
+        parsed.append(int(float(number) * factor))
+    return parsed
+
+
+# thresholds of the units, ascending, for picking the unit of a size by bisection
+SIZE_THRESHOLDS = sorted(ref.SIZE_UNITS.values())
+SIZE_THRESHOLD_UNITS = sorted(ref.SIZE_UNITS, key=ref.SIZE_UNITS.get)
+
+
+def format_size(size: int, block_size=None):
+    """automatically format the size to the most appropriate unit"""
+    if block_size is None or block_size == "auto":
+        i = max(bisect.bisect_right(SIZE_THRESHOLDS, size) - 1, 0)
+        return f"{size / SIZE_THRESHOLDS[i]:.2f} {SIZE_THRESHOLD_UNITS[i]}"
+    return f"{size / ref.SIZE_UNITS[block_size]:.2f} {block_size}"
+
+
+def size_totals(torrents, by="category"):
+    """{value of the `by` attribute: {"count": torrents, "size": total bytes}}, e.g. the total size per category"""
+    totals = {}
+    for torrent in torrents:
+        total = totals.get(getattr(torrent, by))
+        if total is None:
+            totals[getattr(torrent, by)] = {"count": 1, "size": torrent.size}
+        else:
+            total["count"] += 1
+            total["size"] += torrent.size
+    return totals
+
+def torrent_file_url(href, name, domain="rarbgunblocked.org"):
+    return (
+        "https://"
+        + domain
+        + href.replace("torrent/", "download.php?id=")
+        + "&f="
+        + quote(name + "-[rarbg.to].torrent")
+        + "&tpageurl="
+        + quote(href.strip())
+    )
+
+def extract_torrent_file(anchor, domain="rarbgunblocked.org"):
+    return torrent_file_url(anchor.get("href"), anchor.contents[0], domain)
+
+
+MAGNET_TRACKERS = "http%3A%2F%2Ftracker.trackerfix.com%3A80%2Fannounce&tr=udp%3A%2F%2F9.rarbg.me%3A2710&tr=udp%3A%2F%2F9.rarbg.to%3A2710"
+# matches anything containing "over/*.jpg" *: anything
+OVER_IMAGE_RE = re.compile(r"over/([^/'\\]*)\.jpg")
+
+def info_hash_from_overlib(onmouseover):
+    """The info-hash in the anchor's onmouseover preview image, or None"""
+    match = onmouseover and OVER_IMAGE_RE.search(onmouseover)
+    return match[1].lower() if match else None
+
+def magnet_from_hash(info_hash, title):
+    return f"magnet:?xt=urn:btih:{info_hash}&dn={quote(title)}&tr={MAGNET_TRACKERS}"
+
+def magnet_from_overlib(onmouseover, title):
+    """Build the magnet link from the info-hash in the anchor's onmouseover preview image"""
+    info_hash = info_hash_from_overlib(onmouseover)
+    return magnet_from_hash(info_hash, title) if info_hash else ""
+
+def extract_magnet(anchor):
+    # real:
+    #     https://rarbgaccess.org/download.php?id=...&h=120&f=...-[rarbg.to].torrent
+    #     https://rarbgaccess.org/download.php?id=...&      f=...-[rarbg.com].torrent
+    # https://www.rarbgaccess.org/download.php?id=...&h=120&f=...-[rarbg.to].torrent
+    try:
+        return magnet_from_overlib(anchor.get("onmouseover"), anchor.get("title"))
+    except Exception:
+        return ""
+
+
+class Torrent:
+    """A search result, as yielded by iter_torrents.
+
+    Compact record (__slots__, no per-instance dict): the size is kept in bytes, the
+    info-hash is read once while parsing and the magnet, .torrent and detail page URLs
+    are only built when asked for. Records compare and hash by `key`, the info-hash
+    (or the detail page path when the listing had no hash). JSON is made by `to_dict`.
+    """
+    __slots__ = ("title", "info_hash", "path", "domain", "date", "category_code", "size",
+                 "seeders", "leechers", "uploader", "name", "resolved_magnet")
+
+    def __init__(self, title, info_hash, path, domain, date, category_code, size, seeders, leechers, uploader,
+                 name=None, resolved_magnet=None):
+        self.title = title
+        self.info_hash = info_hash
+        self.path = path
+        self.domain = domain
+        self.date = date
+        self.category_code = category_code
+        self.size = size
+        self.seeders = seeders
+        self.leechers = leechers
+        self.uploader = uploader
+        self.name = None if name == title else name  # the anchor text, nearly always the title
+        self.resolved_magnet = resolved_magnet  # from the detail page, when the listing had no info-hash
+
+    @property
+    def key(self):
+        return self.info_hash or self.path
+
+    def __eq__(self, other):
+        if not isinstance(other, Torrent):
+            return NotImplemented
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"Torrent({self.title!r}, {self.key!r})"
+
+    @property
+    def href(self):
+        return f"https://{self.domain}{self.path}"
+
+    @property
+    def torrent(self):
+        return torrent_file_url(self.path, self.name or self.title, self.domain)
+
+    @property
+    def magnet(self):
+        if self.info_hash:
+            return magnet_from_hash(self.info_hash, self.title)
+        return self.resolved_magnet or ""
+
+    @property
+    def category(self):
+        return ref.CODE2CATEGORY.get(self.category_code, "UNKOWN")
+
+    def to_dict(self, block_size=None):
+        return {
+            "title": self.title,
+            "torrent": self.torrent,
+            "href": self.href,
+            "date": self.date,
+            "category": self.category,
+            "size": format_size(self.size, block_size),
+            "seeders": self.seeders,
+            "leechers": self.leechers,
+            "uploader": self.uploader,
+            "magnet": self.magnet,
+            "category_code": self.category_code,
+            "size_bytes": self.size,
+        }
+
+    def to_record(self):
+        """Compact JSON-able form (a list of the slots), see from_record"""
+        return [getattr(self, slot) for slot in self.__slots__]
+
+    @classmethod
+    def from_record(cls, record):
+        torrent = cls.__new__(cls)
+        for slot, value in zip(cls.__slots__, record):
+            setattr(torrent, slot, value)
+        return torrent
+
+
+# == listing page parser ==
+# Every backend walks each `tr.lista2` row once and reads its cells by position:
+#   1: category image, 2: torrent anchor, 3: date, 4: size, 5: seeders (in <font>), 6: leechers, 8: uploader
+LISTING_PARSERS = ["auto", "selectolax", "lxml", "html.parser"]
+# bump when Torrent records change shape, so cached pages of the old shape are ignored
+LISTING_SCHEMA = 3
+TORRENT_HREF_RE = re.compile(r"^/torrent/")
+
+def _make_torrents(domain, rows):
+    """Torrent records of the raw cells of a page's rows:
+    (title, href, name, onmouseover, category_src, date, size, seeders, leechers, uploader)"""
+    sizes = parse_sizes([row[6] for row in rows])
+    return [
+        Torrent(
+            title=title,
+            info_hash=info_hash_from_overlib(onmouseover),
+            path=href,
+            domain=domain,
+            date=datetime.datetime.fromisoformat(date.strip()).timestamp(),
+            category_code=category_src.rsplit("/", 1)[-1].replace("cat_new", "").replace(".gif", ""),
+            size=size,
+            seeders=int(seeders),
+            leechers=int(leechers),
+            uploader=uploader,
+            name=name,
+        )
+        for (title, href, name, onmouseover, category_src, date, _, seeders, leechers, uploader), size
+        in zip(rows, sizes)
+    ]
+
+def _parse_listing_soup(html, domain, features):
+    from bs4 import BeautifulSoup
+
+    rows = []
+    for row in BeautifulSoup(html, features).find_all("tr", class_="lista2"):
+        cells = row.find_all("td", recursive=False)
+        anchor = row.find("a", href=TORRENT_HREF_RE, title=True)
+        if anchor is None or len(cells) < 8:
+            continue
+        rows.append((
+            anchor["title"],
+            anchor["href"],
+            anchor.contents[0],
+            anchor.get("onmouseover"),
+            cells[0].img["src"],
+            cells[2].contents[0],
+            cells[3].contents[0],
+            cells[4].font.contents[0],
+            cells[5].contents[0],
+            str(cells[7].contents[0]),
+        ))
+    return _make_torrents(domain, rows)
+
+def _parse_listing_selectolax(html, domain):
+    from selectolax.lexbor import LexborHTMLParser
+
+    rows = []
+    for row in LexborHTMLParser(html).css("tr.lista2"):
+        cells = [child for child in row.iter() if child.tag == "td"]
+        anchor = row.css_first('a[href^="/torrent/"][title]')
+        if anchor is None or len(cells) < 8:
+            continue
+        attrs = anchor.attributes
+        rows.append((
+            attrs["title"],
+            attrs["href"],
+            anchor.text(deep=False),
+            attrs.get("onmouseover"),
+            cells[0].css_first("img").attributes["src"],
+            cells[2].text(deep=False),
+            cells[3].text(deep=False),
+            cells[4].css_first("font").text(),
+            cells[5].text(deep=False),
+            cells[7].text(),
+        ))
+    return _make_torrents(domain, rows)
+
+def _available_listing_parser(backend):
+    if backend != "auto":
+        return backend
+    for backend, module in [("selectolax", "selectolax.lexbor"), ("lxml", "lxml")]:
+        try:
+            __import__(module)
+            return backend
+        except ImportError:
+            continue
+    return "html.parser"
+
+def parse_listing(html, domain="rarbgunblocked.org", backend="auto"):
+    """Parse a torrents.php listing page into a list of Torrent records (in page order).
+
+    `backend` is one of LISTING_PARSERS, "auto" picks selectolax, then lxml, then html.parser.
+    """
+    backend = _available_listing_parser(backend)
+    if backend == "selectolax":
+        if isinstance(html, bytes):
+            html = html.decode("utf-8", "replace")
+        return _parse_listing_selectolax(html, domain)
+    return _parse_listing_soup(html, domain, backend)
+
+# the listing orders of the site (--order, the order of search_url) and the Torrent fields results sort by (--sort)
+ORDER_KEYS = ["data", "filename", "leechers", "seeders", "size", ""]
+SORT_KEYS = ["title", "date", "size", "seeders", "leechers", ""]
+
+
+def search_url(search, category="", domain="rarbgunblocked.org", order="", descending=False, page=1):
+    # target_url = "https://{domain}/torrents.php?search={search}&order={order}&category={category}&page={page}&by={by}"
+    return ref.TARGET_URL.format(
+        domain=domain.strip(),
+        search=quote(search),
+        order=order,
+        category=";".join(ref.CATEGORY2CODE[category]),
+        page=page,
+        by="DESC" if descending else "ASC",
+    )
+
+
+DETAIL_MAGNET_RE = re.compile(r'href="(magnet:[^"]*)"')
+DETAIL_TORRENT_FILE_RE = re.compile(r'href="(/download\.php[^"]*)"')
+
+def extract_detail_links(html):
+    """Pick the magnet and /download.php hrefs out of a torrent detail page without building a DOM"""
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", "replace")
+    magnet = DETAIL_MAGNET_RE.search(html)
+    torrent_file = DETAIL_TORRENT_FILE_RE.search(html)
+    if magnet is None:
+        raise ValueError("no magnet link found in detail page")
+    return htmllib.unescape(magnet[1]), torrent_file and htmllib.unescape(torrent_file[1])
@@ -0,0 +1,14 @@
+"""Where rarbgapi keeps its files: $RARBGAPI_HOME/.rarbgapi (default ~/.rarbgapi)
+
+Nothing is created on import, whatever writes a file creates its directory first.
+"""
+import os
+
+HOME_DIRECTORY = os.environ.get("RARBGAPI_HOME", os.path.expanduser("~"))
+PROGRAM_HOME = os.path.join(HOME_DIRECTORY, ".rarbgapi")
+COOKIES_PATH = os.path.join(PROGRAM_HOME, "cookies.json")
+CACHE_DIRECTORY = os.path.join(PROGRAM_HOME, "cache")
+INDEX_PATH = os.path.join(PROGRAM_HOME, "index.sqlite3")
+WATCH_DIRECTORY = os.path.join(PROGRAM_HOME, "watch")
+HISTORY_DIRECTORY = os.path.join(PROGRAM_HOME, "history")  # .html page dumps of older versions
+ARCHIVE_PATH = os.path.join(PROGRAM_HOME, "archive.sqlite3")
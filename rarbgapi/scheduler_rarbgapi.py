@@ -0,0 +1,130 @@
+"""Request scheduler: an adaptive token bucket per domain, serving listing pages before detail pages"""
+import asyncio
+import heapq
+import itertools
+import time
+
+# request priorities, lower goes first
+PRIORITY_LISTING = 0
+PRIORITY_DETAIL = 1
+
+
+class _Bucket:
+    __slots__ = ("rate", "tokens", "updated", "ceiling", "waiters", "timer", "slots")
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.ceiling = None  # the rate we were last pushed back at
+        self.waiters = []  # heap of (priority, seq, future)
+        self.timer = None
+        self.slots = {}  # priority: earliest time of its next request, for capped priorities
+
+    def refill(self, now):
+        self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RequestScheduler:
+    """Paces the requests of every fetch path, per domain (asyncio, one event loop).
+
+    Each domain has a token bucket refilled at its current rate (bursts of up to one
+    second of requests). The rate adapts AIMD style: every successful response adds
+    `increase` requests/s up to `max_rate` (a tenth of that once within 90% of the rate
+    we were last pushed back at), every 429/5xx or threat defence redirect multiplies it
+    by `decrease`, down to `min_rate`, and empties the bucket. Waiting requests are
+    served by priority (PRIORITY_LISTING before PRIORITY_DETAIL), then in arrival order.
+    `caps` ({priority: requests/s}, see `cap`) hold the requests of a priority to a domain
+    below a rate of their own as well, e.g. the detail pages below --detail_rate: they
+    still take their tokens from the domain's bucket, so back-offs slow them down too.
+    With `rate=None` nothing but the caps is paced.
+    """
+
+    def __init__(self, rate=8.0, max_rate=32.0, min_rate=0.5, increase=0.5, decrease=0.5, caps=None):
+        self.rate = rate
+        self.max_rate = max(max_rate, rate or 0)
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.caps = {priority: cap for priority, cap in (caps or {}).items() if cap}
+        self._buckets = {}
+        self._seq = itertools.count()
+
+    def cap(self, priority, rate):
+        """At most `rate` requests/s of `priority` to a domain (None or 0: no cap)"""
+        if rate:
+            self.caps[priority] = rate
+        else:
+            self.caps.pop(priority, None)
+
+    def _bucket(self, domain):
+        bucket = self._buckets.get(domain)
+        if bucket is None:
+            bucket = self._buckets[domain] = _Bucket(self.rate)
+        return bucket
+
+    async def acquire(self, domain, priority=PRIORITY_LISTING):
+        """Wait for the turn of a request to `domain`"""
+        if self.rate is None and priority not in self.caps:
+            return
+        bucket = self._bucket(domain)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(bucket.waiters, (priority, next(self._seq), future))
+        self._dispatch(bucket)
+        await future
+
+    def _dispatch(self, bucket):
+        if bucket.timer is not None:
+            bucket.timer.cancel()
+            bucket.timer = None
+        now = time.monotonic()
+        if self.rate is not None:
+            bucket.refill(now)
+        delay = 0
+        while bucket.waiters:
+            priority, _, future = bucket.waiters[0]
+            if future.done():  # cancelled waiters are skipped
+                heapq.heappop(bucket.waiters)
+                continue
+            delay = self._delay(bucket, priority, now)
+            if delay > 0:
+                break
+            heapq.heappop(bucket.waiters)
+            if self.rate is not None:
+                bucket.tokens -= 1
+            if priority in self.caps:
+                bucket.slots[priority] = max(now, bucket.slots.get(priority, now)) + 1 / self.caps[priority]
+            future.set_result(None)
+        if bucket.waiters:
+            bucket.timer = asyncio.get_running_loop().call_later(delay, self._dispatch, bucket)
+
+    def _delay(self, bucket, priority, now):
+        """Seconds until a request of `priority` can go: a token of the bucket and, if capped, its slot"""
+        delay = 0
+        if self.rate is not None and bucket.tokens < 1:
+            delay = (1 - bucket.tokens) / bucket.rate
+        if priority in self.caps:
+            delay = max(delay, bucket.slots.get(priority, now) - now)
+        return delay
+
+    def success(self, domain):
+        if self.rate is None:
+            return
+        bucket = self._bucket(domain)
+        near_ceiling = bucket.ceiling is not None and bucket.rate >= 0.9 * bucket.ceiling
+        bucket.rate = min(self.max_rate, bucket.rate + (self.increase / 10 if near_ceiling else self.increase))
+
+    def backoff(self, domain):
+        """The site pushed back (429, 5xx, threat defence): slow down"""
+        if self.rate is None:
+            return
+        bucket = self._bucket(domain)
+        bucket.refill(time.monotonic())
+        bucket.ceiling = bucket.rate
+        bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+        bucket.tokens = min(bucket.tokens, 0.0)
+
+    def rates(self):
+        """{domain: current requests/s}"""
+        return {domain: bucket.rate for domain, bucket in self._buckets.items()}
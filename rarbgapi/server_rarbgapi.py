@@ -0,0 +1,227 @@
+"""Long-running local HTTP/JSON server sharing one warm client (connections, cookies, caches, CAPTCHA solver),
+and the thin client the command line talks to it with"""
+import asyncio
+import http.client
+import json
+import logging
+import os
+import socket
+import stat
+from urllib.parse import urlencode, urlsplit
+
+import ref_rarbgapi as ref
+from filter_rarbgapi import TorrentFilter, parse_date_arg, parse_size_arg
+from parse_rarbgapi import ORDER_KEYS, SORT_KEYS
+from singleflight_rarbgapi import SingleFlight
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+TRUE = {"1", "true", "yes", "on"}
+
+
+def _date_param(text):
+    """A date like the command line's, or a timestamp (what the thin client sends)"""
+    try:
+        return float(text)
+    except ValueError:
+        return parse_date_arg(text)
+
+
+def parse_search_params(params):
+    """The search of /search query parameters (a mapping of strings): (fetch options, output options).
+
+    Raises ValueError on invalid parameters. Identical fetch options are one upstream search.
+    With a sort, the search fetches every match unresolved; the limit and resolving the
+    magnets apply to the sorted results (output options "limit" and "resolve").
+    """
+    params = dict(params)
+    search = params.pop("search", None)
+    if search is None:
+        raise ValueError("missing search")
+    category = params.pop("category", "")
+    if category not in ref.CATEGORY2CODE:
+        raise ValueError(f"unknown category {category!r}")
+    order = params.pop("order", "")
+    if order not in ORDER_KEYS:
+        raise ValueError(f"unknown order {order!r}")
+    fetch = {
+        "search": search,
+        "category": category,
+        "order": order,
+        "descending": params.pop("descending", "").lower() in TRUE,
+        "limit": int(params.pop("limit")) if "limit" in params else float("inf"),
+        "refresh": params.pop("refresh", "").lower() in TRUE,
+        "resolve": params.pop("resolve", "1").lower() in TRUE,
+        "min_size": parse_size_arg(params.pop("min_size")) if "min_size" in params else None,
+        "max_size": parse_size_arg(params.pop("max_size")) if "max_size" in params else None,
+        "min_seeders": int(params.pop("min_seeders")) if "min_seeders" in params else None,
+        "since": _date_param(params.pop("since")) if "since" in params else None,
+        "until": _date_param(params.pop("until")) if "until" in params else None,
+        "uploader": params.pop("uploader", None),
+    }
+    sort = params.pop("sort", "")
+    if sort not in SORT_KEYS:
+        raise ValueError(f"unknown sort {sort!r}")
+    block_size = params.pop("block_size", "").upper()
+    block_size = None if block_size in ("", "AUTO") else block_size
+    if block_size is not None and block_size not in ref.SIZE_UNITS:
+        raise ValueError(f"unknown block size {block_size!r}")
+    output = {"sort": sort, "block_size": block_size, "format": params.pop("format", "json"),
+              "limit": None, "resolve": False}
+    if sort:
+        output.update(limit=fetch["limit"], resolve=fetch["resolve"])
+        fetch.update(limit=float("inf"), resolve=False)
+    if output["format"] not in ("json", "ndjson"):
+        raise ValueError(f"unknown format {output['format']!r}")
+    if params:
+        raise ValueError("unknown parameters: " + ", ".join(sorted(params)))
+    return fetch, output
+
+
+class SearchServer:
+    """HTTP/JSON API over one AsyncRarbgClient, for any number of concurrent local clients.
+
+    GET /search?search=...  runs a search (parameters: see parse_search_params) and
+                            answers the JSON array the command line prints, or NDJSON
+    GET /metrics            the client's metrics in the Prometheus text format
+    GET /stats              the same as JSON
+    GET /health             {"status": "ok", "in_flight": n}
+
+    The client stays open between requests, so the connection pool, cookies, result
+    cache, scheduler and CAPTCHA solver stay warm. Identical searches in flight at the
+    same time are coalesced: later requests wait for the first one's result instead of
+    fetching again. At most `max_queries` different searches run at once; `search_kwargs`
+    (domain, concurrency, parser, workers) apply to every search.
+    """
+
+    def __init__(self, client, max_queries=8, **search_kwargs):
+        self.client = client
+        self.metrics = client.metrics
+        self.search_kwargs = search_kwargs
+        self._queries = asyncio.Semaphore(max_queries)
+        self._in_flight = SingleFlight(self.metrics, "coalesced")
+
+    def app(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/search", self.handle_search)
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.router.add_get("/stats", self.handle_stats)
+        app.router.add_get("/health", self.handle_health)
+        return app
+
+    async def search(self, fetch):
+        """The Torrent records of a search (the fetch options of parse_search_params), coalesced"""
+        self.metrics.count("queries")
+        # a client going away doesn't cancel the search for the others waiting on it
+        return await self._in_flight.do(json.dumps(fetch, sort_keys=True), self._search, dict(fetch))
+
+    async def _search(self, fetch):
+        search, limit, resolve = fetch.pop("search"), fetch.pop("limit"), fetch.pop("resolve")
+        where = TorrentFilter(**{name: fetch.pop(name) for name in TorrentFilter.__slots__}) or None
+        async with self._queries:
+            return await self.client.search(search, limit, resolve, where=where, **fetch, **self.search_kwargs)
+
+    async def handle_search(self, request):
+        from aiohttp import web
+
+        try:
+            fetch, output = parse_search_params(request.query)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        try:
+            torrents = await self.search(fetch)
+        except Exception as e:
+            logging.warning("Search %s failed: %r", fetch, e)
+            return web.json_response({"error": repr(e)}, status=502)
+        if output["sort"]:
+            torrents = sorted(torrents, key=lambda t: getattr(t, output["sort"]), reverse=True)
+            if output["limit"] is not None and output["limit"] < len(torrents):
+                torrents = torrents[:output["limit"]]
+            if output["resolve"]:
+                await self.client.resolve_magnets(torrents, self.search_kwargs.get("workers", 4))
+        dicts = [t.to_dict(output["block_size"]) for t in torrents]
+        if output["format"] == "ndjson":
+            return web.Response(text="".join(json.dumps(d) + "\n" for d in dicts), content_type="application/x-ndjson")
+        return web.json_response(dicts)
+
+    async def handle_metrics(self, request):
+        from aiohttp import web
+
+        return web.Response(text=self.metrics.to_prometheus(), content_type="text/plain")
+
+    async def handle_stats(self, request):
+        from aiohttp import web
+
+        return web.json_response(self.metrics.summary())
+
+    async def handle_health(self, request):
+        from aiohttp import web
+
+        return web.json_response({"status": "ok", "in_flight": len(self._in_flight)})
+
+    async def run(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None, started=None):
+        """Serve on host:port, or on the Unix socket `path`, until cancelled.
+
+        `started` (an asyncio.Event) is set once the server accepts connections.
+        """
+        from aiohttp import web
+
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        try:
+            if path:
+                if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                    os.unlink(path)  # left over by a server that didn't shut down
+                site = web.UnixSite(runner, path)
+                await site.start()
+                os.chmod(path, 0o600)
+            else:
+                site = web.TCPSite(runner, host, port)
+                await site.start()
+            logging.info("Serving on %s", site.name)
+            if started is not None:
+                started.set()
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def connect(address, timeout=None):
+    """HTTP connection to a server `address`: host:port, http://host:port, or a Unix socket path (or unix:path)"""
+    if address.startswith("unix:") or address.startswith("/"):
+        return UnixHTTPConnection(address[len("unix:"):] if address.startswith("unix:") else address, timeout)
+    url = urlsplit(address if "//" in address else "//" + address)
+    return http.client.HTTPConnection(url.hostname or DEFAULT_HOST, url.port or DEFAULT_PORT, timeout=timeout)
+
+
+def query_server(address, params, timeout=None):
+    """Run a search on the server at `address` (the thin client), return the torrent dicts.
+
+    `params` are the /search parameters; None values are left out. Raises RuntimeError
+    with the server's message when it rejects or fails the search.
+    """
+    params = {name: str(value).lower() if isinstance(value, bool) else value
+              for name, value in params.items() if value is not None}
+    connection = connect(address, timeout)
+    try:
+        connection.request("GET", "/search?" + urlencode(params))
+        response = connection.getresponse()
+        body = json.loads(response.read())
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RuntimeError(f"server: {body.get('error', response.status)}")
+    return body
@@ -0,0 +1,62 @@
+"""Single-flight: concurrent calls with the same key share one call (asyncio, one event loop)"""
+import asyncio
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url):
+    """The key of a URL for coalescing: scheme and host lowercased, default port, fragment and
+    blank query parameters dropped, query parameters sorted"""
+    url = urlsplit(url.strip())
+    scheme = url.scheme.lower()
+    netloc = (url.hostname or "").lower()
+    if url.port and url.port != DEFAULT_PORTS.get(scheme):
+        netloc += f":{url.port}"
+    query = urlencode(sorted(parse_qsl(url.query)))
+    return f"{scheme}://{netloc}{url.path or '/'}" + (f"?{query}" if query else "")
+
+
+class SingleFlight:
+    """Coalesces concurrent calls: while a call of a key is in flight, later callers of the
+    same key await its result (or exception) instead of starting their own.
+
+    The call runs as a task of its own, so a caller giving up (cancelled) doesn't cancel it
+    for the others; it's cancelled once every caller waiting on it has given up. Callers that
+    joined a call in flight are counted in `metrics` under `counter`, if given.
+    """
+
+    def __init__(self, metrics=None, counter=None):
+        self.metrics = metrics
+        self.counter = counter
+        self._calls = {}  # key: [task, callers waiting]
+
+    def __len__(self):
+        return len(self._calls)
+
+    def __contains__(self, key):
+        return key in self._calls
+
+    async def do(self, key, function, *args, **kwargs):
+        """Await `function(*args, **kwargs)`, or the call of `key` already in flight"""
+        call = self._calls.get(key)
+        if call is None:
+            call = [asyncio.ensure_future(function(*args, **kwargs)), 0]
+            self._calls[key] = call
+            call[0].add_done_callback(lambda _: self._forget(key, call))
+        elif self.metrics is not None and self.counter:
+            self.metrics.count(self.counter)
+        call[1] += 1
+        try:
+            return await asyncio.shield(call[0])
+        except asyncio.CancelledError:
+            if not call[0].done():
+                call[1] -= 1
+                if not call[1]:
+                    call[0].cancel()
+                    self._forget(key, call)
+            raise
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
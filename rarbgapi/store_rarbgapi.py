@@ -0,0 +1,181 @@
+"""Local SQLite index of every torrent seen, with full-text search (FTS5) over titles"""
+import os
+import re
+import sqlite3
+import threading
+import time
+
+SORT_COLUMNS = {
+    "title": "t.title",
+    "date": "t.date",
+    "size": "t.size",
+    "seeders": "t.seeders",
+    "leechers": "t.leechers",
+    "": "t.date",
+}
+
+TOTAL_COLUMNS = {"category": "t.category", "category_code": "t.category_code", "uploader": "t.uploader"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS torrents (
+    info_hash TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    category_code TEXT,
+    category TEXT,
+    size INTEGER,
+    seeders INTEGER,
+    leechers INTEGER,
+    uploader TEXT,
+    date REAL,
+    href TEXT,
+    torrent TEXT,
+    magnet TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS torrents_category ON torrents(category_code);
+CREATE INDEX IF NOT EXISTS torrents_date ON torrents(date);
+CREATE INDEX IF NOT EXISTS torrents_seeders ON torrents(seeders);
+CREATE VIRTUAL TABLE IF NOT EXISTS torrents_fts USING fts5(title, content='torrents', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS torrents_ai AFTER INSERT ON torrents BEGIN
+    INSERT INTO torrents_fts(rowid, title) VALUES (new.rowid, new.title);
+END;
+CREATE TRIGGER IF NOT EXISTS torrents_ad AFTER DELETE ON torrents BEGIN
+    INSERT INTO torrents_fts(torrents_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+END;
+CREATE TRIGGER IF NOT EXISTS torrents_au AFTER UPDATE OF title ON torrents BEGIN
+    INSERT INTO torrents_fts(torrents_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+    INSERT INTO torrents_fts(rowid, title) VALUES (new.rowid, new.title);
+END;
+"""
+
+UPSERT = """
+INSERT INTO torrents (info_hash, title, category_code, category, size, seeders, leechers, uploader, date, href, torrent, magnet, updated)
+VALUES (:info_hash, :title, :category_code, :category, :size, :seeders, :leechers, :uploader, :date, :href, :torrent, :magnet, :updated)
+ON CONFLICT(info_hash) DO UPDATE SET
+    title = excluded.title,
+    category_code = excluded.category_code,
+    category = excluded.category,
+    size = excluded.size,
+    seeders = excluded.seeders,
+    leechers = excluded.leechers,
+    uploader = excluded.uploader,
+    date = excluded.date,
+    href = excluded.href,
+    torrent = excluded.torrent,
+    magnet = CASE WHEN excluded.magnet != '' THEN excluded.magnet ELSE torrents.magnet END,
+    updated = excluded.updated
+"""
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query matching titles containing every word"""
+    words = re.findall(r"\w+", text)
+    return " ".join('"%s"' % word for word in words)
+
+
+class TorrentStore:
+    """Torrent records keyed by info-hash, upserted on every crawl and searchable offline"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def upsert(self, torrents):
+        """Insert or update Torrent records, return how many had an info-hash"""
+        now = time.time()
+        rows = [
+            {
+                "info_hash": t.info_hash,
+                "title": t.title,
+                "category_code": t.category_code,
+                "category": t.category,
+                "size": t.size,
+                "seeders": t.seeders,
+                "leechers": t.leechers,
+                "uploader": t.uploader,
+                "date": t.date,
+                "href": t.href,
+                "torrent": t.torrent,
+                "magnet": t.magnet,
+                "updated": now,
+            }
+            for t in torrents
+            if t.info_hash
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany(UPSERT, rows)
+        return len(rows)
+
+    def search(self,
+        query="",
+        category="",
+        min_size=None,
+        max_size=None,
+        min_seeders=None,
+        uploader=None,
+        since=None,
+        until=None,
+        sort="",
+        descending=True,
+        limit=None,
+    ):
+        """Torrent rows (dicts) whose title contains every word of `query`, filtered and sorted"""
+        where, params = self._where(query, category, min_size, max_size, min_seeders, uploader, since, until)
+        sql = "SELECT t.* FROM torrents t"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {SORT_COLUMNS[sort]} {'DESC' if descending else 'ASC'}"
+        if limit is not None and limit < float("inf"):
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(sql, params)]
+
+    def totals(self, by="category", query="", category="", **filters):
+        """{value of the `by` column: {"count": torrents, "size": total bytes}} of the matching torrents,
+        summed by SQLite (the same keywords as `search`, e.g. the total size per category)"""
+        where, params = self._where(query, category, **filters)
+        sql = f"SELECT {TOTAL_COLUMNS[by]} AS value, COUNT(*) AS count, COALESCE(SUM(t.size), 0) AS size FROM torrents t"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " GROUP BY value ORDER BY size DESC"
+        with self._lock:
+            return {row["value"]: {"count": row["count"], "size": row["size"]}
+                    for row in self._connection.execute(sql, params)}
+
+    @staticmethod
+    def _where(query="", category="", min_size=None, max_size=None, min_seeders=None, uploader=None,
+               since=None, until=None):
+        where, params = [], []
+        if fts_query(query):
+            where.append("t.rowid IN (SELECT rowid FROM torrents_fts WHERE torrents_fts MATCH ?)")
+            params.append(fts_query(query))
+        if category:
+            where.append("t.category = ?")
+            params.append(category)
+        for condition, value in [("t.size >= ?", min_size), ("t.size <= ?", max_size),
+                                 ("t.seeders >= ?", min_seeders), ("t.uploader = ?", uploader),
+                                 ("t.date >= ?", since), ("t.date <= ?", until)]:
+            if value is not None:
+                where.append(condition)
+                params.append(value)
+        return where, params
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM torrents").fetchone()[0]